@@ -0,0 +1,116 @@
+"""Compare line protocol encoding against influx_line_protocol
+
+Usage: python3 benchmarks/bench_lineprotocol.py  (needs influx_line_protocol)
+
+Builds the metrics of a 128-port Lightware matrix and a 64x64 Kumo router
+from synthetic device state, then times three ways of encoding one poll as
+text:
+    per-field Metric   one influx_line_protocol Metric per field, as the
+                       collectors did before fields were merged per series
+    per-series Metric  one influx_line_protocol Metric per series
+    lineprotocol       Emitter with cached, pre-escaped series prefixes
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "exec_scripts"))
+
+from influx_line_protocol import Metric, MetricCollection
+
+import aja_kumo
+import lightware_mx2
+
+
+def lightware_state(ports: int) -> dict:
+    half = ports // 2
+    status = {
+        "Connected": "true", "ActiveHdcpVersion": "0", "ColorDepth": "8",
+        "EmbeddedAudioPresent": "true", "Hdcp2StreamType": "0", "MaxSupportedHdcpVersion": "2",
+        "PixelClock": "148.5", "Scrambling": "false", "TmdsClockRate": "false",
+        "BchErrorCounter": "0", "SignalPresent": "true", "TmdsErrorCounters": "0;0;0",
+        "RxTmdsErrorCounters": "0;0;0", "ActiveResolution": "1920x1080p60",
+        "TotalResolution": "2200x1125", "ColorSpace": "RGB", "ColorRange": "Full",
+        "SignalType": "HDMI", "AviIf": "0x82 0x02 0x0d", "VsIf": "0x81 0x01 0x05",
+    }
+    port_ids = [f"I{i}" for i in range(1, half + 1)] + [f"O{i}" for i in range(1, half + 1)]
+    state = {
+        lightware_mx2.FANCONTROL: {
+            "MaximalCurrentTemperature": "48", "Fan1Pwm": "40", "Fan2Pwm": "41", "Fan3Pwm": "42",
+        },
+        lightware_mx2.UID: {"ProductSerialNumber": "1A2B3C4D", "FirmwareVersion": "1.6.0b5"},
+        lightware_mx2.NAMES: {port: f"{port[1:]};Room {port} Wall Plate" for port in port_ids},
+        lightware_mx2.XP: {
+            "DestinationConnectionStatus": "".join(f"I{i};" for i in range(1, half + 1)),
+            "DestinationPortStatus": "T00AA;" * half,
+            "SourcePortStatus": "T00AA;" * half,
+        },
+    }
+    for port in port_ids:
+        state[lightware_mx2.status_path(port)] = dict(status)
+    return state
+
+
+def kumo_response(size: int) -> dict:
+    params = {
+        "eParamID_NumberOfSources": str(size),
+        "eParamID_FormattedSerialNumber": "KUMO-1234",
+        "eParamID_SysName": "Machine Room Kumo",
+        "eParamID_SWVersion": "5.0.0.21",
+        "eParamID_Temperature": "41",
+    }
+    for i in range(1, size + 1):
+        params[f"eParamID_XPT_Destination{i}_Status"] = str(i)
+        params[f"eParamID_XPT_Destination{i}_Line_1"] = f"Stage {i}"
+        params[f"eParamID_XPT_Destination{i}_Line_2"] = "Monitor"
+    return {"configevents": [params]}
+
+
+def per_field_metric(emitter) -> str:
+    collection = MetricCollection()
+    for measurement, tags, timestamp, fields in emitter.series():
+        for name, value in fields.items():
+            metric = Metric(measurement)
+            if timestamp is not None:
+                metric.with_timestamp(timestamp)
+            for tag, tag_value in tags:
+                metric.add_tag(tag, tag_value)
+            metric.add_value(name, value)
+            collection.append(metric)
+    return str(collection)
+
+
+def per_series_metric(emitter) -> str:
+    collection = MetricCollection()
+    for measurement, tags, timestamp, fields in emitter.series():
+        metric = Metric(measurement)
+        if timestamp is not None:
+            metric.with_timestamp(timestamp)
+        for tag, tag_value in tags:
+            metric.add_tag(tag, tag_value)
+        for name, value in fields.items():
+            metric.add_value(name, value)
+        collection.append(metric)
+    return str(collection)
+
+
+def report(name: str, build, number: int = 200):
+    emitter = build()
+    seconds = min(timeit.repeat(build, number=number, repeat=5)) / number
+    print(f"{name}: {len(emitter)} series, built in {seconds * 1e3:.3f} ms")
+    for label, encode in [
+        ("per-field Metric", per_field_metric),
+        ("per-series Metric", per_series_metric),
+        ("lineprotocol", str),
+    ]:
+        output = encode(emitter)
+        seconds = min(timeit.repeat(lambda: encode(emitter), number=number, repeat=5)) / number
+        print(f"  {label:<18} {seconds * 1e3:8.3f} ms/poll {len(output.splitlines()):6d} lines {len(output):8d} bytes")
+
+
+if __name__ == "__main__":
+    state = lightware_state(128)
+    report("Lightware 128 ports", lambda: lightware_mx2.build_metrics("10.0.0.5", state))
+    response = kumo_response(64)
+    report("Kumo 64x64", lambda: aja_kumo.build_metrics(response, 1700000000000000000))
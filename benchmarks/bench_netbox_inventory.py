@@ -0,0 +1,68 @@
+"""Time full and delta syncs of the Netbox inventory against a local fake
+
+Usage: python3 benchmarks/bench_netbox_inventory.py [devices] [latency]
+
+Compares fetching every device as whole REST records, 50 per page as the
+Netbox default, against netbox_inventory's wide field-limited pages, then an
+unchanged delta sync, a delta sync after a few device edits and one after a
+site rename, which forces a full sync, and the fallback to the saved
+snapshot when Netbox is unreachable. Each request to the fake is delayed by
+latency seconds (default 0.05) to imitate a remote Netbox. The delta and
+offline results are checked against a full sync as they go.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import requests
+import netbox_inventory
+from fake_netbox import FakeNetbox
+
+
+def measure(label: str, fake: FakeNetbox, func):
+    before = fake.requests
+    start = time.perf_counter()
+    result = func()
+    print(f"  {label:<26} {time.perf_counter() - start:7.2f} s {fake.requests - before:5d} requests {len(result):6d} devices")
+    return result
+
+
+def default_pages(url: str) -> list:
+    devices = []
+    next_url = f"{url}/api/dcim/devices/?has_primary_ip=true"
+    while next_url:
+        page = requests.get(next_url, timeout=60).json()
+        devices.extend(page["results"])
+        next_url = page.get("next")
+    return devices
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    fake = FakeNetbox(count, float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
+    fake.serve()
+    os.environ["NETBOX_TOKEN"] = "fake"
+    path = os.path.join(tempfile.mkdtemp(), "netbox.json.gz")
+
+    print(f"{count} devices, {fake.latency * 1e3:.0f} ms per request")
+    measure("REST, 50 per page", fake, lambda: default_pages(fake.url))
+    measure("full sync", fake, lambda: netbox_inventory.inventory(fake.url, path, full=True))
+    print(f"  snapshot {os.path.getsize(path) / 1024:.0f} kB")
+    measure("delta, nothing changed", fake, lambda: netbox_inventory.inventory(fake.url, path))
+    for id in range(1, 11):
+        fake.update(id, description="moved")
+    fake.update(2, primary_ip=None)
+    devices = measure("delta, 10 devices edited", fake, lambda: netbox_inventory.inventory(fake.url, path))
+    assert sum(device["description"] == "moved" for device in devices) == 9
+    full = netbox_inventory.sync(netbox_inventory.Netbox(fake.url, "fake"), full=True)["devices"]
+    assert devices == list(full.values()), "delta sync differs from a full sync"
+    fake.touch("dcim/sites")
+    devices = measure("delta after a site rename", fake, lambda: netbox_inventory.inventory(fake.url, path))
+
+    fake.latency = 0
+    offline = measure("offline", fake, lambda: netbox_inventory.inventory("http://127.0.0.1:9", path))
+    assert offline == devices, "offline didn't return the saved snapshot"
@@ -0,0 +1,91 @@
+"""Memory and time of parsing a Planar VC9 full_configuration whole or streamed
+
+Usage: python3 benchmarks/bench_planar_stream.py [panels...]
+
+For synthetic walls of increasing size the JSON body is cut into 64 KiB
+chunks, as it arrives from the socket, and turned into line protocol by
+    whole          joining the body, json.loads() and ConfigIndex, as
+                   collect() did before it streamed
+    stream         ArrayParser into one Emitter, as collect() does
+    stream+write   ArrayParser with each line written as it is parsed, as
+                   `planar_vc9.py <host> stream` does
+Peak memory is measured with tracemalloc, time without it.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "exec_scripts"))
+
+import planar_vc9
+from emitter import Emitter
+from jsonstream import ArrayParser, CHUNK
+from bench_planar_vc9 import ConfigIndex, get_objects, synthetic_config
+
+
+def whole(chunks: list, sink):
+    data = json.loads(b"".join(chunks))["data"]
+    index = ConfigIndex(data)
+    emitter = Emitter()
+    for class_ in planar_vc9.PROCESSORS:
+        for metric in get_objects(index, class_):
+            emitter.add(*metric, 0)
+    emitter.write(sink)
+
+
+def blocks(chunks: list):
+    parser = ArrayParser("data")
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+def stream(chunks: list, sink):
+    emitter = Emitter()
+    for block in blocks(chunks):
+        emitter.add(*planar_vc9.PROCESSORS[block["class"]](block), 0)
+    emitter.write(sink)
+
+
+def stream_write(chunks: list, sink):
+    for block in blocks(chunks):
+        emitter = Emitter()
+        emitter.add(*planar_vc9.PROCESSORS[block["class"]](block), 0)
+        emitter.write(sink)
+
+
+class Sink(io.TextIOBase):
+    """Counts what is written without keeping it"""
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.size += len(text)
+        return len(text)
+
+
+def measure(func, chunks: list) -> tuple:
+    tracemalloc.start()
+    func(chunks, Sink())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    sink = Sink()
+    start = time.perf_counter()
+    func(chunks, sink)
+    return peak, time.perf_counter() - start, sink.size
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [250, 1000, 4000]
+    print(f"{'panels':>6} {'body':>9}  {'path':<13} {'peak':>9} {'time':>9} {'output':>9}")
+    for panels in sizes:
+        body = json.dumps({"data": synthetic_config(panels)}).encode()
+        chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)]
+        for name, func in [("whole", whole), ("stream", stream), ("stream+write", stream_write)]:
+            peak, seconds, size = measure(func, chunks)
+            print(f"{panels:6d} {len(body) / 1024:7.0f}kB  {name:<13} {peak / 1024:7.0f}kB {seconds * 1e3:7.1f}ms {size / 1024:7.0f}kB")
@@ -0,0 +1,173 @@
+"""Compare per-class scans of a Planar VC9 full_configuration with ConfigIndex
+
+Usage: python3 benchmarks/bench_planar_vc9.py [panels]
+
+Builds a synthetic configuration with one input and source port per panel
+plus the controllers and power hardware of a large wall, then times
+    9 scans       one pass over the blocks per class, as collect() used to
+    ConfigIndex   one pass to group and index the blocks, as it did before
+                  collect() parsed the configuration as a stream
+with and without running the processors, and the panel -> input ->
+source_port lookup by linear search and through the index. ConfigIndex is
+no longer in planar_vc9.py: streaming the configuration and dispatching each
+block to its extractor as it is parsed superseded it, and no metric follows
+relations between blocks.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "exec_scripts"))
+
+import planar_vc9
+
+
+class ConfigIndex:
+    """Index of a full_configuration built in one pass over its blocks
+
+    by_class groups blocks by class in document order and by_key finds a block
+    from the key other blocks use in their relations. The reverse index of
+    which blocks point at a key is only built if referring() is used.
+    """
+
+    def __init__(self, data: list):
+        self.data = data
+        self.by_class = {}
+        self.by_key = {}
+        self._referrers = None
+        for block in data:
+            self.by_class.setdefault(block["class"], []).append(block)
+            self.by_key[block.get("key")] = block
+
+    def related(self, block: dict, *relations: str):
+        """Follow a chain of relations, e.g. related(panel, "input", "source_port").
+        Returns None if any link is missing."""
+        for relation in relations:
+            if block is None:
+                return None
+            block = self.by_key.get((block.get("relations") or {}).get(relation))
+        return block
+
+    def referring(self, relation: str, key) -> list:
+        """Blocks whose relation points at key"""
+        if self._referrers is None:
+            self._referrers = {}
+            for block in self.data:
+                for name, targets in (block.get("relations") or {}).items():
+                    for target in targets if isinstance(targets, list) else [targets]:
+                        if target is not None:
+                            self._referrers.setdefault((name, target), []).append(block)
+        return self._referrers.get((relation, key), [])
+
+
+def get_objects(index: ConfigIndex, item_class: str) -> list:
+    return [planar_vc9.PROCESSORS[item_class](block) for block in index.by_class.get(item_class, [])]
+
+
+def block(class_, key, attributes, relations):
+    return {"class": class_, "key": key, "attributes": attributes, "relations": relations}
+
+
+def synthetic_config(panels: int) -> list:
+    data = [block("System", "system", {
+        "package_version": "3.2.1", "panel_fw_version": "1.8", "preset_status": "ok", "active_preset": "Default",
+    }, {"master": "vc1", "wall": "wall"})]
+
+    for i in range(1, panels // 16 + 2):
+        data.append(block("VideoController", f"vc{i}", {
+            "genlock_status": "locked", "input_option": "hdmi", "model_name": "VC9", "output_mode": "wall",
+            "output_option": "fiber", "package_version": "3.2.1", "serial_number": f"SN{i:05}",
+            "version_fpga_main": "2.1", "version_micro": "1.4", "fan_speed_1": "3200", "fan_speed_2": "3150",
+            "fan_status": "ok", "fpga_temp": "51.5", "intake_temp": "24.0",
+        }, {"input_board": f"ib{i}", "output_board": f"ob{i}"}))
+        data.append(block("OutputExpansion", f"oe{i}", {"fpga_temp": "48.0"}, {"video_controller": f"vc{i}"}))
+        data.append(block("PowerSupply", f"ps{i}", {
+            "name": f"PSU {i}", "connected": "1", "rtc_battery_ok": "1", "temperature": "33.0",
+        }, {"cpu_board": f"cpu{i}", "power_distribution": f"pd{i}", "system": "system"}))
+
+    for i in range(1, panels // 8 + 2):
+        data.append(block("PowerOutlet", f"po{i}", {
+            "breaker_open": "false", "current": "2.4", "position": str(i),
+        }, {"power_distribution": f"pd{i % 8}"}))
+        data.append(block("PowerRectifier", f"pr{i}", {
+            "position": str(i), "fan_fault_1": "0", "fan_fault_2": "0", "fan_speed_1": "4000",
+            "fan_speed_2": "4010", "in_current": "3.1", "in_voltage": "230.0", "out_current": "12.0",
+            "out_voltage": "48.0", "present": "1", "state": "1", "temp_ambient": "29.0", "valid": "1",
+        }, {"power_distribution": f"pd{i % 8}"}))
+
+    for i in range(1, panels + 1):
+        data.append(block("Panel", f"panel{i}", {
+            "device_input": str(i), "fw_version": "1.8", "x": str(i % 40), "y": str(i // 40),
+            "connected": "1", "temperature": "38.5", "voltage_24": "24.1", "voltage_48": "48.2", "watts": "110.0",
+        }, {"input": f"input{i}"}))
+        data.append(block("Input", f"input{i}", {
+            "type": "hdmi", "position": str(i), "connected": "1",
+        }, {"source_port": f"sp{i}"}))
+        data.append(block("SourcePort", f"sp{i}", {
+            "height": 1080, "pixel_depth": "8", "source_presence": "1",
+        }, {"input": f"input{i}"}))
+    return data
+
+
+def scan_per_class(data: list) -> list:
+    return [
+        planar_vc9.PROCESSORS[class_](item)
+        for class_ in planar_vc9.PROCESSORS
+        for item in data
+        if item["class"] == class_
+    ]
+
+
+def group_scan(data: list) -> list:
+    return [item for class_ in planar_vc9.PROCESSORS for item in data if item["class"] == class_]
+
+
+def group_indexed(data: list) -> list:
+    index = ConfigIndex(data)
+    return [item for class_ in planar_vc9.PROCESSORS for item in index.by_class.get(class_, [])]
+
+
+def indexed(data: list) -> list:
+    index = ConfigIndex(data)
+    return [metric for class_ in planar_vc9.PROCESSORS for metric in get_objects(index, class_)]
+
+
+def find(data: list, key):
+    return next((item for item in data if item["key"] == key), None)
+
+
+def lookup_scan(data: list) -> int:
+    found = 0
+    for item in data:
+        if item["class"] == "Panel":
+            port = find(data, find(data, item["relations"]["input"])["relations"]["source_port"])
+            found += port is not None
+    return found
+
+
+def lookup_indexed(data: list) -> int:
+    index = ConfigIndex(data)
+    return sum(index.related(item, "input", "source_port") is not None for item in index.by_class["Panel"])
+
+
+def measure(label: str, func, data: list, number: int):
+    result = func(data)
+    seconds = min(timeit.repeat(lambda: func(data), number=number, repeat=5)) / number
+    count = result if isinstance(result, int) else len(result)
+    print(f"  {label:<14} {seconds * 1e3:9.3f} ms {count:6d} results")
+
+
+if __name__ == "__main__":
+    panels = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    data = synthetic_config(panels)
+    print(f"{panels} panels, {len(data)} blocks")
+    print("grouping blocks by class")
+    measure("9 scans", group_scan, data, 20)
+    measure("ConfigIndex", group_indexed, data, 20)
+    print("grouping and processors")
+    measure("9 scans", scan_per_class, data, 10)
+    measure("ConfigIndex", indexed, data, 10)
+    print("panel -> input -> source_port")
+    measure("linear search", lookup_scan, data, 1)
+    measure("ConfigIndex", lookup_indexed, data, 10)
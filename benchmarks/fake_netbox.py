@@ -0,0 +1,136 @@
+"""A local fake of the Netbox REST endpoints used by tools/netbox_inventory.py
+
+Usage: python3 benchmarks/fake_netbox.py [devices] [port]
+
+Serves synthetic devices from /api/dcim/devices/ with limit/offset paging and
+the has_primary_ip, last_updated__gte, brief and fields parameters, and the
+site, location, device type and manufacturer lists for change checks. Every
+request can be delayed by LATENCY seconds to imitate a remote Netbox.
+"""
+
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+RELATED = ["dcim/sites", "dcim/locations", "dcim/device-types", "dcim/manufacturers"]
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def synthetic_device(id: int) -> dict:
+    """A device record with the nesting and some of the bulk of a real one"""
+    return {
+        "id": id,
+        "url": f"/api/dcim/devices/{id}/",
+        "display": f"device-{id}",
+        "name": f"device-{id}",
+        "serial": f"SN{id:06}",
+        "description": f"Room {id // 8} rack",
+        "site": {"id": 1, "url": "/api/dcim/sites/1/", "display": "HQ", "name": "HQ", "slug": "hq"},
+        "location": {"id": id // 8, "url": f"/api/dcim/locations/{id // 8}/", "name": f"Room {id // 8}", "slug": f"room-{id // 8}"},
+        "device_type": {
+            "id": 3, "url": "/api/dcim/device-types/3/", "display": "MX2-8x8", "model": "MX2-8x8", "slug": "mx2-8x8",
+            "manufacturer": {"id": 2, "url": "/api/dcim/manufacturers/2/", "name": "Lightware", "slug": "lightware"},
+        },
+        "role": {"id": 4, "name": "Matrix", "slug": "matrix"},
+        "platform": None,
+        "tenant": None,
+        "rack": {"id": id // 40, "name": f"Rack {id // 40}"},
+        "position": 12.0,
+        "face": {"value": "front", "label": "Front"},
+        "status": {"value": "active", "label": "Active"},
+        "primary_ip": {"id": id, "family": 4, "address": f"10.{id // 65536}.{id // 256 % 256}.{id % 256}/16"},
+        "primary_ip4": {"id": id, "family": 4, "address": f"10.{id // 65536}.{id // 256 % 256}.{id % 256}/16"},
+        "primary_ip6": None,
+        "comments": "",
+        "config_context": {"ntp_servers": ["10.0.0.1", "10.0.0.2"], "syslog": {"host": "10.0.0.3"}},
+        "tags": [],
+        "custom_fields": {"allow_alerts": True, "telegraf_templates": ["lightware_mx2", "ping"]},
+        "created": "2024-01-01T00:00:00Z",
+        "last_updated": "2024-01-01T00:00:00+00:00",
+    }
+
+
+class FakeNetbox:
+    """Holds the fake's data; bench_netbox_inventory.py changes it between
+    syncs with update() and touch()"""
+
+    def __init__(self, devices: int, latency: float = 0):
+        self.devices = {id: synthetic_device(id) for id in range(1, devices + 1)}
+        self.related = {endpoint: "2024-01-01T00:00:00+00:00" for endpoint in RELATED}
+        self.latency = latency
+        self.requests = 0
+
+    def update(self, id: int, **changes):
+        self.devices[id] = {**self.devices.get(id, synthetic_device(id)), **changes, "last_updated": now()}
+
+    def touch(self, endpoint: str):
+        self.related[endpoint] = now()
+
+    def listing(self, endpoint: str, query: dict) -> dict:
+        if endpoint == "dcim/devices":
+            results = list(self.devices.values())
+            if query.get("has_primary_ip") == "true":
+                results = [device for device in results if device["primary_ip"]]
+        else:
+            results = [{"id": 1, "last_updated": self.related[endpoint]}]
+
+        since = query.get("last_updated__gte")
+        if since:
+            since = datetime.fromisoformat(since)
+            results = [item for item in results if datetime.fromisoformat(item["last_updated"]) >= since]
+
+        if query.get("brief") == "true":
+            results = [{"id": item["id"], "url": f"/api/{endpoint}/{item['id']}/", "display": str(item["id"])} for item in results]
+        elif query.get("fields"):
+            fields = query["fields"].split(",")
+            results = [{field: item.get(field) for field in fields} for item in results]
+
+        limit, offset = int(query.get("limit", 50)), int(query.get("offset", 0))
+        page = results[offset:offset + limit]
+        next_url = None
+        if offset + limit < len(results):
+            next_url = f"{self.url}/api/{endpoint}/?{urlencode({**query, 'offset': offset + limit})}"
+        return {"count": len(results), "next": next_url, "previous": None, "results": page}
+
+    def serve(self, port: int = 0) -> ThreadingHTTPServer:
+        """Start serving in a thread; the server's URL is set on self.url"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests += 1
+                time.sleep(fake.latency)
+                url = urlsplit(self.path)
+                endpoint = url.path.strip("/").removeprefix("api/")
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                body = json.dumps(fake.listing(endpoint, query)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{server.server_address[1]}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+if __name__ == "__main__":
+    fake = FakeNetbox(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+    server = fake.serve(int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+    print(f"serving {len(fake.devices)} devices on {fake.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
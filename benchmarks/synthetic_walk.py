@@ -0,0 +1,88 @@
+"""Write a walk file with every object a template polls, for snmp_sim.py
+
+Usage: python3 benchmarks/synthetic_walk.py [--rows N] [--latency S] [--bulk-limit N] <template> <walk file>
+
+Fields get one value each and tables ROWS rows of every column, typed from
+the MIBs, so tools/snmp_tune.py can be tried without a device. The agent
+options are written into the file's header.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "exec_scripts"))
+
+import mibc
+import snmp_sim
+import snmp_pdu as pdu
+
+ROWS = 16
+
+
+def value(node: dict, row: int) -> tuple:
+    syntax = node.get("type", "")
+    if node.get("enums"):
+        return pdu.INTEGER, int(sorted(node["enums"], key=int)[row % len(node["enums"])])
+    if syntax in ("Counter32", "Counter"):
+        return pdu.COUNTER32, 1000 * row
+    if syntax in ("Gauge32", "Gauge", "Unsigned32"):
+        return pdu.GAUGE32, 40 + row
+    if syntax == "TimeTicks":
+        return pdu.TIMETICKS, 360000 * row
+    if syntax == "Counter64":
+        return pdu.COUNTER64, 2**33 + row
+    if syntax == "IpAddress":
+        return pdu.IP_ADDRESS, bytes([10, 0, 0, row % 256])
+    if syntax in ("INTEGER", "Integer32", "TruthValue"):
+        return pdu.INTEGER, row + 1
+    return pdu.OCTET_STRING, f"value {row}".encode()
+
+
+def columns(mibs: mibc.Mibs, module_name: str, name: str) -> list:
+    """(module, name) of a table's columns, or the object itself if it isn't a table"""
+    node = mibs.modules[module_name]["nodes"][name]
+    if "entry" not in node:
+        return [(module_name, name)]
+    entry = next(
+        entry for entry, entry_node in mibs.modules[module_name]["nodes"].items()
+        if entry_node["value"] == [name, 1]
+    )
+    return [
+        (module_name, column) for column, column_node in mibs.modules[module_name]["nodes"].items()
+        if column_node["value"][0] == entry
+    ]
+
+
+def synthetic_walk(template: str, mibs: mibc.Mibs, rows: int = ROWS) -> list:
+    with open(template) as f:
+        references = mibc.REFERENCE.findall(f.read())
+    entries = {}
+    for _, module_name, name, index in references:
+        defined = mibs.find(module_name, name)
+        if index:
+            oid = tuple(mibs.oid(defined, name)) + pdu.parse_oid(index)
+            entries[oid] = value(mibs.modules[defined]["nodes"][name], 0)
+            continue
+        for column_module, column in columns(mibs, defined, name):
+            node = mibs.modules[column_module]["nodes"][column]
+            for row in range(1, rows + 1):
+                entries[tuple(mibs.oid(column_module, column)) + (row,)] = value(node, row)
+    return sorted(entries.items())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=ROWS)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--per-varbind", type=float, default=0.0002)
+    parser.add_argument("--bulk-limit", type=int, default=0)
+    parser.add_argument("template")
+    parser.add_argument("walk")
+    opts = parser.parse_args()
+
+    entries = synthetic_walk(opts.template, mibc.Mibs(), opts.rows)
+    options = {"latency": opts.latency, "per_varbind": opts.per_varbind, "bulk_limit": opts.bulk_limit}
+    snmp_sim.dump(opts.walk, entries, options)
+    print(f"{len(entries)} OIDs", file=sys.stderr)
@@ -1,12 +1,27 @@
-"""Collect metrics from AJA Kumo router and return influx line protocol"""
+"""Collect metrics from AJA Kumo router and return influx line protocol
+
+`aja_kumo.py <host> stream` instead keeps a connection ID and long-polls the
+router's config events, applying them to an in-memory parameter map and
+writing crosspoint and label changes as they happen. A fresh connection, and
+with it a full snapshot, is taken every SNAPSHOT seconds to resync.
+"""
 import sys
 import time
 import asyncio
 
-from aiohttp import ClientSession
-from influx_line_protocol import Metric, MetricCollection
+from aiohttp import ClientSession, ClientTimeout
+from emitter import Emitter
+import tiers
+
+# concurrent routers polled by fleet.py
+FLEET_CONCURRENCY = 16
+FLEET_SESSION = True
+
+# seconds between full snapshots in stream mode
+SNAPSHOT = 60
+# the router holds wait_for_config_events open until something changes
+LONG_POLL = ClientTimeout(total=None, sock_read=60)
 
-NOW = time.time_ns()
 
 async def fetch_json(session: ClientSession, url: str) -> dict:
     resp = await session.request(method="GET", url=url)
@@ -28,35 +43,51 @@ def get_value(response, param):
     return parsed_value
 
 
-async def collect():
-    collection = MetricCollection()
-    session = ClientSession()
+async def connect(host: str) -> ClientSession:
+    """Open an HTTP session which can be reused across polls"""
+    return ClientSession()
+
+
+async def disconnect(session: ClientSession):
+    await session.close()
+
+
+async def collect(host: str, conn: ClientSession = None) -> Emitter:
+    """Poll one router. Opens and closes its own session unless conn is given.
+    Polls of the same router from other processes within tiers.SHARED_TTL
+    reuse this one's response."""
+    async def fetch():
+        session = conn or ClientSession()
+        try:
+            url = f"http://{host}/config?action=connect"
+            return [time.time_ns(), await fetch_json(url=url, session=session)]
+        finally:
+            if conn is None:
+                await session.close()
+
+    polled, response = await tiers.shared("aja_kumo", host, fetch)
+    return build_metrics(response, polled)
 
-    url = f"http://{sys.argv[1]}/config?action=connect"
-    response = await fetch_json(url=url, session=session)
 
+def build_metrics(response: dict, now: int = None) -> Emitter:
+    emitter = Emitter()
     router_size = int(response['configevents'][0]['eParamID_NumberOfSources'])
 
-    metric = Metric('kumo')
-    metric.with_timestamp(NOW)
-    metric.add_tag('serial', get_value(response, 'eParamID_FormattedSerialNumber'))
-    metric.add_tag('sysname', get_value(response, 'eParamID_SysName'))
-    metric.add_tag('sw_version', get_value(response, 'eParamID_SWVersion'))
-    metric.add_tag('serial', get_value(response, 'eParamID_FormattedSerialNumber'))
-    metric.add_value('info', 1)
-    collection.append(metric)
+    emitter.add('kumo', {'info': 1}, {
+        'serial': get_value(response, 'eParamID_FormattedSerialNumber'),
+        'sysname': get_value(response, 'eParamID_SysName'),
+        'sw_version': get_value(response, 'eParamID_SWVersion'),
+    }, now)
 
     for i in range(1, router_size+1):
-        metric = Metric("kumo")
-        metric.with_timestamp(NOW)
-        metric.add_tag('dest', str(i))
-
         dest_line1 = get_value(response, f'eParamID_XPT_Destination{i}_Line_1')
         dest_line2 = get_value(response, f'eParamID_XPT_Destination{i}_Line_2')
-        metric.add_tag('dest_label', f"{dest_line1} {dest_line2}".strip())
-
-        metric.add_value('src', get_value(response, f'eParamID_XPT_Destination{i}_Status'))
-        collection.append(metric)
+        emitter.add('kumo', {
+            'src': get_value(response, f'eParamID_XPT_Destination{i}_Status'),
+        }, {
+            'dest': str(i),
+            'dest_label': f"{dest_line1} {dest_line2}".strip(),
+        }, now)
 
     pairs = [
         ('reference_format', 'eParamID_DetectReferenceFormat'),
@@ -68,19 +99,68 @@ async def collect():
         ('connected_panels', 'eParamID_Connected_Panels'),
         ('authentication', 'eParamID_Authentication'),
     ]
-
-    for label, param in pairs:
-        metric = Metric("kumo")
-        metric.with_timestamp(NOW)
-        metric.add_value(label, get_value(response, param))
-        collection.append(metric)
-
-    print(collection)
-    await session.close()
+    emitter.add('kumo', {label: get_value(response, param) for label, param in pairs}, timestamp=now)
+
+    return emitter
+
+
+def apply_events(params: dict, events) -> bool:
+    """Update params from a wait_for_config_events reply, which is either a
+    list of {"param_id", "str_value", ...} events or a configevents object.
+    Returns True if any value changed."""
+    if isinstance(events, dict):
+        updates = {}
+        for block in events.get('configevents') or []:
+            updates.update(block)
+    else:
+        updates = {
+            event['param_id']: event.get('str_value', event.get('int_value'))
+            for event in events or [] if 'param_id' in event
+        }
+
+    changed = False
+    for param, value in updates.items():
+        if params.get(param) != value:
+            params[param] = value
+            changed = True
+    return changed
+
+
+async def stream(host: str, snapshot: float):
+    """Long-poll config events and write only the metrics which changed, plus
+    a full snapshot from a new connection every snapshot seconds"""
+    async with ClientSession() as session:
+        loop = asyncio.get_running_loop()
+        while True:
+            response = await fetch_json(session, f"http://{host}/config?action=connect")
+            connection = response['connectionid']
+            params = response['configevents'][0]
+            previous = build_metrics(response, None)
+            previous.write()
+
+            resync = loop.time() + snapshot
+            url = f"http://{host}/config?action=wait_for_config_events&connectionid={connection}"
+            while loop.time() < resync:
+                async with session.get(url, timeout=LONG_POLL) as resp:
+                    resp.raise_for_status()
+                    events = await resp.json(content_type=None)
+                if not events:
+                    # nothing changed before the router gave up waiting
+                    await asyncio.sleep(1)
+                    continue
+                if not apply_events(params, events):
+                    continue
+                current = build_metrics(response, None)
+                current.diff(previous).write()
+                previous = current
 
 
 if __name__ == '__main__':
+    # example command: python3 aja_kumo.py 192.168.20.13 stream
     try:
-        asyncio.run(collect())
+        if len(sys.argv) == 3 and sys.argv[2] == 'stream':
+            asyncio.run(stream(sys.argv[1], SNAPSHOT))
+        else:
+            print(asyncio.run(collect(sys.argv[1])))
     except Exception as e:
         raise SystemExit(e)
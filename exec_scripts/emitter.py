@@ -0,0 +1,83 @@
+"""Collect fields into one line protocol line per series
+
+Collectors add fields with their measurement, tags and timestamp. Fields for
+the same series are merged, so a port with fifteen fields is written as one
+line instead of fifteen lines that repeat the same tags.
+"""
+
+from functools import lru_cache
+
+import lineprotocol
+
+
+class Emitter:
+    def __init__(self):
+        self._series = {}
+
+    def add(self, measurement: str, fields: dict, tags: dict = None, timestamp: int = None):
+        """Add fields to the series identified by measurement, tags and timestamp"""
+        key = (measurement, series_tags(tags), timestamp)
+        self._series.setdefault(key, {}).update(fields)
+
+    def tag_all(self, name: str, value: str):
+        """Add a tag to every series which doesn't already have it"""
+        series = {}
+        for (measurement, tags, timestamp), fields in self._series.items():
+            tags = dict(tags)
+            tags.setdefault(name, value)
+            series.setdefault((measurement, series_tags(tags), timestamp), {}).update(fields)
+        self._series = series
+
+    def diff(self, previous: "Emitter") -> "Emitter":
+        """Return only the fields whose value differs from previous"""
+        changed = Emitter()
+        for key, fields in self._series.items():
+            before = previous._series.get(key, {})
+            fields = {name: value for name, value in fields.items() if before.get(name) != value}
+            if fields:
+                changed._series[key] = fields
+        return changed
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def series(self):
+        """Yield (measurement, tags, timestamp, fields) for each series, with
+        tags as sorted (name, value) pairs"""
+        for (measurement, tags, timestamp), fields in self._series.items():
+            yield measurement, tags, timestamp, fields
+
+    def lines(self):
+        """Yield the line protocol for each series"""
+        return lineprotocol.encode(self.series())
+
+    def write(self, stream=None):
+        lineprotocol.write(self.lines(), stream)
+
+    def __str__(self) -> str:
+        return "\n".join(self.lines())
+
+
+def series_tags(tags: dict) -> tuple:
+    """Sorted (name, value) pairs with values as strings, usable as a dict key.
+    Tags which are None are left out rather than written as "None". Collectors
+    add the same tags poll after poll, so the sorted form is cached by the
+    tags as given and only built the first time."""
+    if not tags:
+        return ()
+    items = tuple(tags.items())
+    try:
+        # with the types, as 1, 1.0 and True are equal keys but different tags
+        return _frozen_tags(items, tuple(map(type, tags.values())))
+    except TypeError:
+        # an unhashable tag value
+        return _freeze(items)
+
+
+def _freeze(items: tuple) -> tuple:
+    return tuple(sorted((str(name), str(value)) for name, value in items if value is not None))
+
+
+@lru_cache(maxsize=65536)
+def _frozen_tags(items: tuple, types: tuple) -> tuple:
+    return _freeze(items)
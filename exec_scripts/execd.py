@@ -0,0 +1,94 @@
+"""Run an exec_scripts collector resident under Telegraf inputs.execd
+
+Usage: python3 execd.py [--timeout SECONDS] <script> <host> [args...]
+
+The collector module is imported once and any connection opened by its
+connect() hook is kept warm between polls. Each line Telegraf writes to stdin
+(signal = "STDIN") triggers one collect() and the result is written to stdout
+as line protocol. A failed poll drops the connection so the next one reconnects.
+
+A collector module provides:
+    collect(host, *args, conn=None)   sync or async, returns line protocol
+    connect(host, *args)              optional, returns a reusable conn
+    disconnect(conn)                  optional
+"""
+
+import sys
+import asyncio
+import argparse
+import importlib
+import inspect
+
+
+async def call(func, *args, **kwargs):
+    """Call a collector hook which may be sync or async"""
+    if inspect.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+class Collector:
+    """One collector module bound to one device, holding its connection"""
+
+    def __init__(self, module, args: list, timeout: float):
+        self.module = module
+        self.args = args
+        self.timeout = timeout
+        self.conn = None
+
+    async def collect(self):
+        """One collect(), returning what the collector returned"""
+        try:
+            if self.conn is None and hasattr(self.module, "connect"):
+                self.conn = await asyncio.wait_for(call(self.module.connect, *self.args), self.timeout)
+            return await asyncio.wait_for(
+                call(self.module.collect, *self.args, conn=self.conn), self.timeout
+            )
+        except BaseException:
+            await self.close()
+            raise
+
+    async def poll(self) -> str:
+        return str(await self.collect())
+
+    async def close(self):
+        conn, self.conn = self.conn, None
+        if conn is None or not hasattr(self.module, "disconnect"):
+            return
+        try:
+            await call(self.module.disconnect, conn)
+        except Exception:
+            pass
+
+
+async def run(collector: Collector):
+    while True:
+        signal = await asyncio.to_thread(sys.stdin.readline)
+        if not signal:
+            break
+
+        try:
+            output = await collector.poll()
+        except Exception as e:
+            print(f"{collector.module.__name__} {collector.args[0]}: {e!r}", file=sys.stderr, flush=True)
+            continue
+
+        if output:
+            sys.stdout.write(output + "\n")
+            sys.stdout.flush()
+
+    await collector.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--timeout", type=float, default=10, help="seconds allowed per poll")
+    parser.add_argument("script", help="collector module name, e.g. lightware_mx2")
+    parser.add_argument("args", nargs="+", help="host followed by any extra collector arguments")
+    opts = parser.parse_args()
+
+    module = importlib.import_module(opts.script)
+    try:
+        asyncio.run(run(Collector(module, opts.args, opts.timeout)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,88 @@
+"""Poll many devices of one type concurrently from a single process
+
+Usage: python3 fleet.py [--deadline SECONDS] [--concurrency N] <script> <host|@file>...
+
+Every host is collected on one asyncio event loop. Collectors which set
+FLEET_SESSION share a single aiohttp connection pool, while socket collectors
+such as eyepower_pdu and lightware_mx2 hold one non-blocking stream per device.
+At most FLEET_CONCURRENCY (or --concurrency) devices are polled at once and
+each host gets its own deadline, so dead devices only cost their own output.
+Results are written as each device completes; hosts which fail are reported on
+stderr. A file given as @path holds one host per line, followed by any extra
+collector arguments; blank lines and # comments are skipped.
+"""
+
+import sys
+import asyncio
+import argparse
+import importlib
+
+from aiohttp import ClientSession, TCPConnector
+
+
+def read_hosts(specs: list) -> list:
+    """Expand host arguments and @files into a list of argument lists"""
+    targets = []
+    for spec in specs:
+        if not spec.startswith("@"):
+            targets.append([spec])
+            continue
+        with open(spec[1:]) as f:
+            for line in f:
+                line = line.split("#")[0].strip()
+                if line:
+                    targets.append(line.split())
+    return targets
+
+
+async def poll(module, args: list, session, limit: asyncio.Semaphore, deadline: float):
+    """Collect one host, returning (args, output, error)"""
+    async with limit:
+        try:
+            collection = await asyncio.wait_for(module.collect(*args, conn=session), deadline)
+        except Exception as e:
+            return args, None, e
+    # tag metrics with the host they came from unless the collector already did
+    collection.tag_all("source", args[0])
+    return args, str(collection), None
+
+
+async def run(module, targets: list, concurrency: int, deadline: float) -> int:
+    limit = asyncio.Semaphore(concurrency)
+    session = None
+    if getattr(module, "FLEET_SESSION", False):
+        session = ClientSession(connector=TCPConnector(limit=concurrency, ssl=False))
+
+    failed = 0
+    try:
+        polls = [poll(module, args, session, limit, deadline) for args in targets]
+        for done in asyncio.as_completed(polls):
+            args, output, error = await done
+            if error is not None:
+                failed += 1
+                print(f"{module.__name__} {args[0]}: {error!r}", file=sys.stderr, flush=True)
+            elif output:
+                sys.stdout.write(output + "\n")
+                sys.stdout.flush()
+    finally:
+        if session is not None:
+            await session.close()
+
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deadline", type=float, default=5, help="seconds allowed per host")
+    parser.add_argument("--concurrency", type=int, help="override the collector's FLEET_CONCURRENCY")
+    parser.add_argument("script", help="collector module name, e.g. aja_kumo")
+    parser.add_argument("hosts", nargs="+", help="hosts, or @file with one host per line")
+    opts = parser.parse_args()
+
+    module = importlib.import_module(opts.script)
+    concurrency = opts.concurrency or getattr(module, "FLEET_CONCURRENCY", 8)
+    targets = read_hosts(opts.hosts)
+
+    failed = asyncio.run(run(module, targets, concurrency, opts.deadline))
+    if targets and failed == len(targets):
+        raise SystemExit("all hosts failed")
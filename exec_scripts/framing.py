@@ -0,0 +1,126 @@
+"""Incremental framing for the TCP device protocols
+
+A framer owns one bytearray buffer per connection. Bytes are appended as they
+arrive and complete frames are cut out with find() from where the previous
+scan stopped, so a large reply split over many reads is neither rescanned nor
+re-decoded. Consumed bytes are only dropped from the front of the buffer once
+they make up most of it.
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from collections import deque
+
+CHUNK = 65536
+
+
+class Framer(ABC):
+    def __init__(self):
+        self._buffer = bytearray()
+        self._start = 0  # first byte not yet consumed
+        self._scan = 0  # where the next search for a delimiter begins
+        self._frames = deque()
+
+    def feed(self, data: bytes):
+        self._buffer += data
+        self._split()
+        if self._start > len(self._buffer) // 2:
+            del self._buffer[:self._start]
+            self._scan = max(self._scan - self._start, 0)
+            self._start = 0
+
+    @abstractmethod
+    def _split(self):
+        """Move the complete frames in the buffer from _start on to _frames"""
+
+    def clear(self):
+        """Drop any frames received but not yet read, e.g. late replies to an
+        abandoned command"""
+        self._frames.clear()
+
+    async def read(self, reader: asyncio.StreamReader, timeout: float = None):
+        """Return the next complete frame, reading from the stream as needed"""
+        while not self._frames:
+            data = await asyncio.wait_for(reader.read(CHUNK), timeout)
+            if not data:
+                raise ConnectionError("connection closed")
+            self.feed(data)
+        return self._frames.popleft()
+
+
+class LW3Framer(Framer):
+    """Split LW3 output into (signature, lines) for `{sig ... }` reply blocks
+    and (None, line) for unsigned lines such as CHG notifications. Each line
+    is decoded once."""
+
+    def __init__(self):
+        super().__init__()
+        self._signature = None
+        self._block = None
+
+    def _split(self):
+        buffer = self._buffer
+        while True:
+            end = buffer.find(b"\r\n", max(self._scan, self._start))
+            if end < 0:
+                self._scan = max(len(buffer) - 1, self._start)
+                return
+            with memoryview(buffer) as view:
+                line = str(view[self._start:end], "utf-8", "replace")
+            self._start = self._scan = end + 2
+
+            if self._block is None:
+                if line.startswith("{"):
+                    self._signature, self._block = line[1:], []
+                elif line:
+                    self._frames.append((None, line))
+            elif line == "}":
+                self._frames.append((self._signature, self._block))
+                self._signature, self._block = None, None
+            else:
+                self._block.append(line)
+
+
+class DLEFramer(Framer):
+    """Split DLE STX ... DLE ETX framed replies (Eyepower). Doubled DLE bytes in
+    the payload are unstuffed as the frame is assembled, so a DLE pair split
+    across two reads is handled. Frames keep their DLE STX / DLE ETX so reply
+    offsets match the protocol documentation."""
+
+    DLE, STX, ETX = 0x10, 0x02, 0x03
+
+    def __init__(self):
+        super().__init__()
+        self._frame = None
+
+    def _split(self):
+        buffer = self._buffer
+        while True:
+            dle = buffer.find(self.DLE, self._start)
+            if dle < 0 or dle + 1 == len(buffer):
+                # keep a trailing DLE until we know what follows it
+                if self._frame is not None:
+                    stop = len(buffer) if dle < 0 else dle
+                    with memoryview(buffer) as view:
+                        self._frame += view[self._start:stop]
+                    self._start = stop
+                elif dle < 0:
+                    self._start = len(buffer)
+                return
+
+            if self._frame is not None:
+                with memoryview(buffer) as view:
+                    self._frame += view[self._start:dle]
+            code = buffer[dle + 1]
+            self._start = dle + 2
+
+            if code == self.STX:
+                self._frame = bytearray(b"\x10\x02")
+            elif self._frame is None:
+                continue
+            elif code == self.DLE:
+                self._frame.append(self.DLE)
+            elif code == self.ETX:
+                self._frame += b"\x10\x03"
+                self._frames.append(bytes(self._frame))
+                self._frame = None
@@ -0,0 +1,122 @@
+"""Incremental parsing of one array inside a large JSON object
+
+Devices such as the Planar VC9 return `{"data": [block, block, ...]}` where the
+array can be megabytes long. ArrayParser is fed the body as it arrives and
+returns each element of the array as soon as it is complete, so neither the
+whole body nor the whole object tree has to be held in memory. Other keys of
+the object are parsed and discarded.
+"""
+
+import codecs
+import json
+
+CHUNK = 65536
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_FOLLOWERS = _WHITESPACE + ",:]}"
+
+START, KEY, COLON, VALUE, ARRAY, ITEMS, DONE = range(7)
+
+
+class ArrayParser:
+    def __init__(self, key: str):
+        self.key = key
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._pos = 0
+        self._state = START
+        self._name = None
+
+    def feed(self, data: bytes) -> list:
+        """Add bytes and return the array elements completed by them"""
+        self._text += self._utf8.decode(data)
+        items = []
+        text = self._text
+        while self._state != DONE:
+            pos = self._skip(text, self._pos)
+            if pos == len(text):
+                break
+            char = text[pos]
+
+            if self._state == START:
+                self._expect(char, "{")
+                self._state = KEY
+            elif self._state == KEY:
+                if char == "}":
+                    raise ValueError(f"JSON object has no {self.key!r} key")
+                if char == ",":
+                    self._pos = pos + 1
+                    continue
+                value = self._value(text, pos)
+                if value is None:
+                    break
+                self._name, pos = value
+                self._state = COLON
+                continue
+            elif self._state == COLON:
+                self._expect(char, ":")
+                self._state = ARRAY if self._name == self.key else VALUE
+            elif self._state == VALUE:
+                value = self._value(text, pos)
+                if value is None:
+                    break
+                self._state = KEY
+                continue
+            elif self._state == ARRAY:
+                self._expect(char, "[")
+                self._state = ITEMS
+            elif self._state == ITEMS:
+                if char == "]":
+                    self._state = DONE
+                elif char != ",":
+                    value = self._value(text, pos)
+                    if value is None:
+                        break
+                    items.append(value[0])
+                    continue
+            self._pos = pos + 1
+
+        # drop parsed text once it makes up most of the buffer
+        if self._pos > len(self._text) // 2:
+            self._text = self._text[self._pos:]
+            self._pos = 0
+        return items
+
+    def close(self):
+        """Raise if the body ended before the array did"""
+        if self._state != DONE:
+            raise ValueError(f"JSON ended before the end of {self.key!r}")
+
+    def _skip(self, text: str, pos: int) -> int:
+        while pos < len(text) and text[pos] in _WHITESPACE:
+            pos += 1
+        self._pos = pos
+        return pos
+
+    def _value(self, text: str, pos: int):
+        """Decode the value at pos, or return None if it may not be complete
+        yet. A value is only accepted once it is followed by whitespace or
+        punctuation, so a number cut off by the end of a chunk (`1` of `1.25`)
+        is never taken as complete."""
+        try:
+            value, end = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return None
+        if end == len(text) or text[end] not in _FOLLOWERS:
+            return None
+        self._pos = end
+        return value, end
+
+    def _expect(self, char: str, expected: str):
+        if char != expected:
+            raise ValueError(f"expected {expected!r} in JSON, got {char!r}")
+
+
+async def iter_array(response, key: str):
+    """Yield the elements of response_json[key] from an aiohttp response"""
+    parser = ArrayParser(key)
+    async for chunk in response.content.iter_chunked(CHUNK):
+        for item in parser.feed(chunk):
+            yield item
+    parser.close()
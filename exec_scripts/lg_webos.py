@@ -2,105 +2,166 @@ import sys
 import asyncio
 import csv
 
+import tiers
 from bscpylgtv import WebOsClient
-from influx_line_protocol import Metric, MetricCollection
+from emitter import Emitter
+
+KEYFILE = '/run/webos_keys.csv'
+# seconds between websocket pings on resident connections
+PING_INTERVAL = 20
+# seconds between full-state writes in stream mode
+HEARTBEAT = 60
+
+# serial -> client key, loaded from KEYFILE on first use
+_keys = None
+
+
+def load_keys() -> dict:
+    """Read KEYFILE into a dict of serial -> client key"""
+    try:
+        with open(KEYFILE, mode='r') as f:
+            return {row['serial']: row['key'] for row in csv.DictReader(f)}
+    except FileNotFoundError:
+        raise OSError(f"Unable to read key file: {KEYFILE}")
+
+
+def read_client_key(serial: str) -> str:
+    """Look up the client key for a TV serial number. KEYFILE is read once
+    and read again only when a serial is missing, e.g. a newly added TV."""
+    global _keys
+    if _keys is None or serial not in _keys:
+        _keys = load_keys()
+    try:
+        return _keys[serial]
+    except KeyError:
+        raise LookupError(f"Unable to read key for serial: {serial}")
+
+
+async def connect(host: str, serial: str, ping_interval=PING_INTERVAL) -> WebOsClient:
+    """Open an authenticated websocket which can be reused across polls. The
+    client subscribes to power, app, volume, mute, input, sound output and
+    picture settings, so those properties stay current without requests."""
+    client = await WebOsClient.create(host, get_hello_info=True, ping_interval=ping_interval,
+                                      client_key=read_client_key(serial))
+    await client.connect()
+    return client
 
-TV_IP = sys.argv[1]
-TV_SERIAL = sys.argv[2]
 
-async def collect(client_key):
-    collection = MetricCollection()
+async def disconnect(client: WebOsClient):
+    await client.disconnect()
 
-    client = await WebOsClient.create(TV_IP, get_hello_info=True, ping_interval=None, client_key=client_key)
-    await client.connect()
 
-    audio_status = await client.get_audio_status()
-    configs = await client.get_configs()
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_tag("audio_volume_mode", audio_status['volumeStatus']['mode'])
-    metric.add_tag('audio_output', client.sound_output)
-    metric.add_tag('power_state', client.power_state.get('state'))
-    metric.add_tag('current_app', client.current_appId)
-    metric.add_tag('model_name', client.system_info.get('modelName'))
-    metric.add_tag('firmware_version', f"{client.software_info.get('major_ver')}.{client.software_info.get('minor_ver')}")
-    metric.add_tag('webos_ReleaseVersion', f"{client.hello_info.get('deviceOSReleaseVersion')}")
-    metric.add_tag('webos_Version', f"{client.hello_info.get('deviceOSVersion')}")
-    metric.add_tag('serial', f"{client.system_info.get('serialNumber')}")
-    metric.add_tag('cell_type', f"{configs['configs'].get('tv.model.cellType')}")
-    metric.add_tag('edid_type', f"{configs['configs'].get('tv.model.edidType')}")
-    metric.add_tag('lvdsBits', f"{configs['configs'].get('tv.model.lvdsBits')}")
-    metric.add_tag('moduleBackLightType', f"{configs['configs'].get('tv.model.moduleBackLightType')}")
-    metric.add_tag('panelGamutType', f"{configs['configs'].get('tv.model.panelGamutType')}")
-    metric.add_tag('panelLedBarType', f"{configs['configs'].get('tv.model.panelLedBarType')}")
-    metric.add_tag('soundModeType', f"{configs['configs'].get('tv.model.soundModeType')}")
-    metric.add_tag('panelGamutType', f"{configs['configs'].get('tv.model.panelGamutType')}")
-    metric.add_tag('panelGamutType', f"{configs['configs'].get('tv.model.panelGamutType')}")
-    metric.add_value('info', 1)
-    collection.append(metric)
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_value('audio_volume', client.volume)
-    collection.append(metric)
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_value('audio_mute_state', int(client.muted))
-    collection.append(metric)
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_value('picture_backlight', client.picture_settings.get('backlight'))
-    collection.append(metric)
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_value('picture_brightness', client.picture_settings.get('brightness'))
-    collection.append(metric)
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_value('picture_color', client.picture_settings.get('color'))
-    collection.append(metric)
-
-    metric = Metric("webos")
-    metric.add_tag('source', TV_IP)
-    metric.add_value('picture_contrast', client.picture_settings.get('contrast'))
-    collection.append(metric)
+async def collect(host: str, serial: str, conn: WebOsClient = None) -> Emitter:
+    """Poll one TV. Connects and disconnects its own client unless conn is given."""
+    client = conn or await connect(host, serial, ping_interval=None)
+    try:
+        if not client.is_connected():
+            # the TV dropped the websocket; reconnect the same client
+            await client.connect()
+        return await read_metrics(client, host)
+    finally:
+        if conn is None:
+            await client.disconnect()
+
+
+async def get_model_configs(client: WebOsClient, host: str) -> dict:
+    """tv.model.* configs, which are fixed for a TV, from the slow tier"""
+    async def fetch():
+        return (await client.get_configs())['configs']
+    return await tiers.cached("lg_webos", host, fetch)
+
+
+async def read_metrics(client: WebOsClient, host: str) -> Emitter:
+    emitter = Emitter()
+
+    # everything else comes from subscribed state
+    audio_status, configs = await asyncio.gather(
+        client.get_audio_status(), get_model_configs(client, host)
+    )
+
+    emitter.add("webos", {'info': 1}, {
+        'source': host,
+        "audio_volume_mode": audio_status['volumeStatus']['mode'],
+        'audio_output': client.sound_output,
+        'power_state': client.power_state.get('state'),
+        'current_app': client.current_appId,
+        'model_name': client.system_info.get('modelName'),
+        'firmware_version': f"{client.software_info.get('major_ver')}.{client.software_info.get('minor_ver')}",
+        'webos_ReleaseVersion': f"{client.hello_info.get('deviceOSReleaseVersion')}",
+        'webos_Version': f"{client.hello_info.get('deviceOSVersion')}",
+        'serial': f"{client.system_info.get('serialNumber')}",
+        'cell_type': f"{configs.get('tv.model.cellType')}",
+        'edid_type': f"{configs.get('tv.model.edidType')}",
+        'lvdsBits': f"{configs.get('tv.model.lvdsBits')}",
+        'moduleBackLightType': f"{configs.get('tv.model.moduleBackLightType')}",
+        'panelGamutType': f"{configs.get('tv.model.panelGamutType')}",
+        'panelLedBarType': f"{configs.get('tv.model.panelLedBarType')}",
+        'soundModeType': f"{configs.get('tv.model.soundModeType')}",
+    })
+
+    emitter.add("webos", {
+        'audio_volume': client.volume,
+        'audio_mute_state': int(client.muted),
+        'picture_backlight': client.picture_settings.get('backlight'),
+        'picture_brightness': client.picture_settings.get('brightness'),
+        'picture_color': client.picture_settings.get('color'),
+        'picture_contrast': client.picture_settings.get('contrast'),
+    }, {'source': host})
 
     for input in ['hdmi1', 'hdmi2', 'hdmi3', 'hdmi4']:
-        spd_vendor = client.inputs[f'com.webos.app.{input}'].get('spdVendorName')
-        spd_description = client.inputs[f'com.webos.app.{input}'].get('spdProductDescription')
-        spd_info = client.inputs[f'com.webos.app.{input}'].get('spdSourceDeviceInfo')
-
-        metric = Metric("webos")
-        metric.add_tag('source', TV_IP)
-        metric.add_tag('input', input)
-        metric.add_tag('spd_device', f"{spd_vendor} {spd_description}")
-        metric.add_tag('spd_info', spd_info)
-        metric.add_tag('label', client.inputs[f'com.webos.app.{input}']['label'])
-        metric.add_value('input_info', 1)
-        collection.append(metric)
-
-        metric = Metric("webos")
-        metric.add_tag('source', TV_IP)
-        metric.add_tag('input', input)
-        metric.add_tag('label', client.inputs[f'com.webos.app.{input}']['label'])
-        metric.add_value('input_connected', int(client.inputs[f'com.webos.app.{input}']['connected']))
-        collection.append(metric)
-
-        metric = Metric("webos")
-        metric.add_tag('source', TV_IP)
-        metric.add_tag('input', input)
-        metric.add_tag('label', client.inputs[f'com.webos.app.{input}']['label'])
-        metric.add_value('hdmiPlugIn', int(client.inputs[f'com.webos.app.{input}']['hdmiPlugIn']))
-        collection.append(metric)
-
-    print(collection)
-
-    await client.disconnect()
+        app = client.inputs[f'com.webos.app.{input}']
+        spd_vendor = app.get('spdVendorName')
+        spd_description = app.get('spdProductDescription')
+        spd_info = app.get('spdSourceDeviceInfo')
+        tags = {'source': host, 'input': input, 'label': app['label']}
+
+        emitter.add("webos", {'input_info': 1}, {
+            **tags,
+            'spd_device': f"{spd_vendor} {spd_description}",
+            'spd_info': spd_info,
+        })
+        emitter.add("webos", {
+            'input_connected': int(app['connected']),
+            'hdmiPlugIn': int(app['hdmiPlugIn']),
+        }, tags)
+
+    return emitter
+
+
+async def stream(host: str, serial: str, heartbeat: float):
+    """Write metrics whenever the TV reports a state change, only for values
+    which changed, plus the full state every heartbeat seconds"""
+    client = await connect(host, serial)
+    changed = asyncio.Event()
+
+    async def on_state_update(*args):
+        changed.set()
+
+    try:
+        await client.register_state_update_callback(on_state_update)
+        previous = await read_metrics(client, host)
+        previous.write()
+
+        loop = asyncio.get_running_loop()
+        next_heartbeat = loop.time() + heartbeat
+        while True:
+            try:
+                await asyncio.wait_for(changed.wait(), max(next_heartbeat - loop.time(), 0))
+            except asyncio.TimeoutError:
+                if not client.is_connected():
+                    await client.connect()
+                previous = await read_metrics(client, host)
+                previous.write()
+                next_heartbeat = loop.time() + heartbeat
+                continue
+
+            # a burst of callbacks is handled as one change
+            changed.clear()
+            current = await read_metrics(client, host)
+            current.diff(previous).write()
+            previous = current
+    finally:
+        await disconnect(client)
 
 
 def to_binary(str: str) -> int:
@@ -111,11 +172,11 @@ def to_binary(str: str) -> int:
         return 0
 
 
-async def obtain_credentials():
+async def obtain_credentials(host: str):
     """Run interactively to obtain and print credentials for new TV"""
 
-    print(f"Connecting to {TV_IP}. Please accept prompt on TV.")
-    client = await WebOsClient.create(TV_IP, get_hello_info=True)
+    print(f"Connecting to {host}. Please accept prompt on TV.")
+    client = await WebOsClient.create(host, get_hello_info=True)
     await client.connect()
 
     #print(f"Connected to {client.proto}://{client.ip}:{client.port}")
@@ -130,26 +191,18 @@ async def obtain_credentials():
 
 if __name__ == '__main__':
     # example command: python3 lg_webos.py 192.168.20.13 init
+    # or: python3 lg_webos.py 192.168.20.13 <serial> stream
     if len(sys.argv) == 3 and sys.argv[2] == 'init':
-        asyncio.run(obtain_credentials())
-
-    else:
-        keyfile = '/run/webos_keys.csv'
+        asyncio.run(obtain_credentials(sys.argv[1]))
 
+    elif len(sys.argv) == 4 and sys.argv[3] == 'stream':
         try:
-            with open(keyfile, mode='r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row['serial'] == TV_SERIAL:
-                        client_key = row['key']
-                        break
-                else:
-                    raise SystemExit(f"Unable to read key for serial: {TV_SERIAL}")
-
-        except (FileNotFoundError):
-            raise SystemExit(f"Unable to read key file: {keyfile}")
+            asyncio.run(stream(sys.argv[1], sys.argv[2], HEARTBEAT))
+        except Exception as e:
+            raise SystemExit(e)
 
+    else:
         try:
-            asyncio.run(collect(client_key))
+            print(asyncio.run(collect(sys.argv[1], sys.argv[2])))
         except Exception as e:
             raise SystemExit(e)
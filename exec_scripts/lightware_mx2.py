@@ -1,248 +1,44 @@
 """Collect metrics from Lightware MX2 matrix using LW3 protocol"""
 
-import os
 import sys
-import socket
+import time
+import asyncio
 
-from influx_line_protocol import Metric, MetricCollection
+import tiers
+from emitter import Emitter
+from lw3 import LW3Client, parse_nodes, parse_properties
 
 
-def collect():
-    host = sys.argv[1]
-    port = 6107
-    collection = MetricCollection()
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(10)
-    sock.connect((host, port))
+TIMEOUT = 10
 
-    # read CPU temperature
-    fan_response = get_properties(sock, f"/SYS/HSMB/FANCONTROL")
-    metric = Metric("mx2")
-    metric.add_tag("source", host)
-    metric.add_value("matrix_temperature", float(fan_response['MaximalCurrentTemperature']))
-    collection.append(metric)
+# seconds between full-state writes in stream mode
+HEARTBEAT = 60
 
-    # read average of 3 fan speeds
-    metric = Metric("mx2")
-    metric.add_tag("source", host)
-    avg_fan_rpm = (float(fan_response['Fan1Pwm']) + float(fan_response['Fan2Pwm']) + float(fan_response['Fan3Pwm'])) / 3
-    metric.add_value("matrix_fan_rpm", avg_fan_rpm)
-    collection.append(metric)
+# concurrent matrices polled by fleet.py
+FLEET_CONCURRENCY = 64
 
-    # read firmware version
-    uid_response = get_properties(sock, f"/MANAGEMENT/UID")
-    metric = Metric("mx2")
-    metric.add_tag("source", host)
-    metric.add_tag("serial", uid_response["ProductSerialNumber"])
-    metric.add_tag("firmware_version", uid_response["FirmwareVersion"])
-    metric.add_value("matrix_info", 1)
-    collection.append(metric)
-
-    # read names of each port
-    response = get_properties(sock, "/MEDIA/NAMES/VIDEO")
-    port_names = {}
-    for port in response:
-        port_names[port] = response[port].split(";")[1]
+# seconds between full STATUS reads of a port which is idle and unchanged
+IDLE_REFRESH = 300
 
-    # metric for which input is routed to each destination
-    # value of 0 means no source is routed
-    response = get(sock, "/MEDIA/XP/VIDEO.DestinationConnectionStatus")
-    i = 0
-    for value in response.split(";")[:-1]:
-        port = f"O{i+1}"
 
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        if value == '0':
-            metric.add_value("xpt_connection", 0)
-        else:
-            metric.add_value("xpt_connection", int(value[1:]))
-        collection.append(metric)
-        i += 1
-
-    # metric for destination port locked/muted state
-    response = get(sock, "/MEDIA/XP/VIDEO.DestinationPortStatus")
-    i = 0
-    for code in response.split(";")[:-1]:
-        port = f"O{i+1}"
-        port_name = port_names[port]
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("dest_locked", 0 if code[0] in ["T", "M"] else 1)
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("dest_muted", 0 if code[0] in ["T", "L"] else 1)
-        collection.append(metric)
-
-        i += 1
-
-    # metric for source port locked/muted state
-    response = get(sock, "/MEDIA/XP/VIDEO.SourcePortStatus")
-    i = 0
-    for code in response.split(";")[:-1]:
-        port = f"I{i+1}"
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("src_locked", 0 if code[0] in ["T", "M"] else 1)
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("src_muted", 0 if code[0] in ["T", "L"] else 1)
-        collection.append(metric)
-
-        i += 1
-
-    # metrics for properties of each port
-    ports = get_nodes(sock, "/MEDIA/PORTS/VIDEO")
-    for port in ports:
-        status = get_properties(sock, f"/MEDIA/PORTS/VIDEO/{port}/STATUS")
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value(
-            "port_connected", 0 if status["Connected"].lower() == "false" else 1
-        )
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("active_hdcp_version", int(status["ActiveHdcpVersion"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("color_depth", int(status["ColorDepth"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value(
-            "embedded_audio_present", to_binary(status["EmbeddedAudioPresent"])
-        )
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("hdcp2_stream_type", int(status["Hdcp2StreamType"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value(
-            "max_supported_hdcp_version", int(status["MaxSupportedHdcpVersion"])
-        )
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("pixel_clock", float(status["PixelClock"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("scrambling", to_binary(status["Scrambling"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("tmds_clock_rate", to_binary(status["TmdsClockRate"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("bch_error_count", int(status["BchErrorCounter"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("active_hdcp_version", int(status["ActiveHdcpVersion"]))
-        collection.append(metric)
-
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_value("signal_present", to_binary(status["SignalPresent"]))
-        collection.append(metric)
-
-        for ch in range(3):
-            metric = Metric("mx2")
-            metric.add_tag("source", host)
-            metric.add_tag("port", port)
-            metric.add_tag("port_name", port_names[port])
-            metric.add_tag("tmds_ch", str(ch))
-            metric.add_value(
-                "tmds_error_count",
-                to_binary(status["TmdsErrorCounters"].split(";")[ch]),
-            )
-            collection.append(metric)
-
-            metric = Metric("mx2")
-            metric.add_tag("source", host)
-            metric.add_tag("port", port)
-            metric.add_tag("port_name", port_names[port])
-            metric.add_tag("tmds_ch", str(ch))
-            metric.add_value(
-                "rx_tmds_error_count",
-                to_binary(status["RxTmdsErrorCounters"].split(";")[ch]),
-            )
-            collection.append(metric)
-
-        # add info metric with static value 1
-        metric = Metric("mx2")
-        metric.add_tag("source", host)
-        metric.add_tag("port", port)
-        metric.add_tag("port_name", port_names[port])
-        metric.add_tag("active_resolution", status["ActiveResolution"])
-        metric.add_tag("total_resolution", status["TotalResolution"])
-        metric.add_tag("color_space", status["ColorSpace"])
-        metric.add_tag("color_range", status["ColorRange"])
-        metric.add_tag("signal_type", status["SignalType"])
-        metric.add_tag("avi_if", status["AviIf"])
-        metric.add_tag("vs_if", status["VsIf"])
-        metric.add_value("info", 1)
-        collection.append(metric)
-
-    sock.shutdown(socket.SHUT_RDWR)
-    sock.close()
-    print(collection)
+async def connect(host: str) -> LW3Client:
+    """Open an LW3 connection which can be reused across polls"""
+    return await LW3Client.open(host, timeout=TIMEOUT)
+
+
+async def disconnect(client: LW3Client):
+    await client.close()
+
+
+async def collect(host: str, conn: LW3Client = None) -> Emitter:
+    """Poll one matrix. Opens and closes its own connection unless conn is given."""
+    client = conn or await connect(host)
+    try:
+        state = await read_state(client, host)
+    finally:
+        if conn is None:
+            await disconnect(client)
+    return build_metrics(host, state)
 
 
 def to_binary(str: str) -> int:
@@ -253,59 +49,259 @@ def to_binary(str: str) -> int:
         return 0
 
 
-def get(sock: socket.socket, cmd: str) -> str:
-    """Send command to device and return parsed response"""
-    sock.sendall(f"GET {cmd}\r\n".encode())
-
-    response = ""
-    for _ in range(100):
-        data = sock.recv(1024)
-        response += data.decode()
-        if data.decode().endswith("\r\n") or data.decode() == "":
-            break
-
-    return response.strip().split(cmd)[1][1:]
-
-
-def get_nodes(sock: socket.socket, cmd: str) -> list:
-    """Send command to device and return list of nodes"""
-    sock.sendall(f"GET {cmd}\r\n".encode())
-
-    response = ""
-    for _ in range(100):
-        data = sock.recv(1024)
-        response += data.decode()
-        if data.decode().endswith("\r\n") or data.decode() == "":
-            break
-
-    results = []
-    for line in response.strip().split("\r\n"):
-        results.append(line.split(cmd)[1][1:])
+FANCONTROL = "/SYS/HSMB/FANCONTROL"
+UID = "/MANAGEMENT/UID"
+NAMES = "/MEDIA/NAMES/VIDEO"
+XP = "/MEDIA/XP/VIDEO"
+PORTS = "/MEDIA/PORTS/VIDEO"
+
+# STATUS property: (field, converter)
+PORT_FIELDS = {
+    "Connected": ("port_connected", lambda value: 0 if value.lower() == "false" else 1),
+    "ActiveHdcpVersion": ("active_hdcp_version", int),
+    "ColorDepth": ("color_depth", int),
+    "EmbeddedAudioPresent": ("embedded_audio_present", to_binary),
+    "Hdcp2StreamType": ("hdcp2_stream_type", int),
+    "MaxSupportedHdcpVersion": ("max_supported_hdcp_version", int),
+    "PixelClock": ("pixel_clock", float),
+    "Scrambling": ("scrambling", to_binary),
+    "TmdsClockRate": ("tmds_clock_rate", to_binary),
+    "BchErrorCounter": ("bch_error_count", int),
+    "SignalPresent": ("signal_present", to_binary),
+}
+
+# STATUS property: field, split into one value per TMDS channel
+PORT_CHANNEL_FIELDS = {
+    "TmdsErrorCounters": "tmds_error_count",
+    "RxTmdsErrorCounters": "rx_tmds_error_count",
+}
+
+# STATUS property: tag on the port info metric
+PORT_INFO_TAGS = {
+    "ActiveResolution": "active_resolution",
+    "TotalResolution": "total_resolution",
+    "ColorSpace": "color_space",
+    "ColorRange": "color_range",
+    "SignalType": "signal_type",
+    "AviIf": "avi_if",
+    "VsIf": "vs_if",
+}
+
+
+def status_path(port: str) -> str:
+    return f"{PORTS}/{port}/STATUS"
+
+
+async def read_inventory(client: LW3Client) -> dict:
+    """Read the slow-tier nodes: device identity, port names and the port list"""
+    nodes = [UID, NAMES]
+    *responses, ports_response = await client.send(
+        [f"GET {path}.*" for path in nodes] + [f"GET {PORTS}"]
+    )
+    inventory = {path: parse_properties(response) for path, response in zip(nodes, responses)}
+    inventory[PORTS] = parse_nodes(ports_response)
+    return inventory
+
+
+# STATUS properties read from every port on every poll
+PORT_SUMMARY = ["Connected", "SignalPresent"]
+
+# host -> {STATUS path: (properties, time of the full read)}
+_port_status = {}
+
+
+def needs_status(summary: dict, cached: tuple, now: float) -> bool:
+    """Whether a port's full STATUS should be read on this poll: it is
+    connected or has signal, its summary changed, or its last full read is
+    older than IDLE_REFRESH"""
+    if cached is None or now - cached[1] >= IDLE_REFRESH:
+        return True
+    if any(value and value.lower() not in ("false", "0") for value in summary.values()):
+        return True
+    return any(cached[0].get(prop) != value for prop, value in summary.items())
+
+
+async def read_state(client: LW3Client, host: str) -> dict:
+    """Read every node used for metrics into a {path: {property: value}} tree.
+    UID, port names and the port list are slow-tier and cached in tiers. The
+    fan, crosspoint and each port's Connected/SignalPresent are read in one
+    pipelined batch, then the full STATUS only of ports which need it; idle
+    ports have only their fresh summary, so no stale counters are written
+    with a new timestamp."""
+    inventory = tiers.get("lightware_mx2", host)
+    if inventory is None:
+        inventory = await read_inventory(client)
+        tiers.put("lightware_mx2", host, inventory)
+
+    paths = [status_path(port) for port in inventory[PORTS]]
+    fans, xp, *summaries = await client.send(
+        [f"GET {FANCONTROL}.*", f"GET {XP}.*"]
+        + [f"GET {path}.{prop}" for path in paths for prop in PORT_SUMMARY]
+    )
+    summary = {path: {} for path in paths}
+    for i, response in enumerate(summaries):
+        summary[paths[i // len(PORT_SUMMARY)]].update(parse_properties(response))
+
+    now = time.monotonic()
+    cache = _port_status.setdefault(host, {})
+    deep = [path for path in paths if needs_status(summary[path], cache.get(path), now)]
+    if deep:
+        for path, response in zip(deep, await client.send([f"GET {path}.*" for path in deep])):
+            cache[path] = (parse_properties(response), now)
+
+    # copies, as stream mode updates the state in place
+    state = {
+        FANCONTROL: parse_properties(fans),
+        UID: dict(inventory[UID]),
+        NAMES: dict(inventory[NAMES]),
+        XP: parse_properties(xp),
+    }
+    for path in paths:
+        state[path] = dict(cache[path][0]) if path in deep else summary[path]
+    return state
+
+
+def build_metrics(host: str, state: dict) -> Emitter:
+    emitter = Emitter()
+    for path in state:
+        node_metrics(emitter, host, state, path)
+    return emitter
+
+
+def node_metrics(emitter: Emitter, host: str, state: dict, path: str):
+    """Add the metrics derived from one node of the state tree"""
+    port_names = {port: name.split(";")[1] for port, name in state[NAMES].items()}
+
+    if path == FANCONTROL:
+        fan_metrics(emitter, host, state[path])
+    elif path == UID:
+        uid_metrics(emitter, host, state[path])
+    elif path == XP:
+        xp_metrics(emitter, host, state[path], port_names)
+    elif path.startswith(PORTS):
+        port = path.split("/")[4]
+        port_metrics(emitter, host, port, port_names[port], state[path])
+
+
+def fan_metrics(emitter: Emitter, host: str, fan_response: dict):
+    # read CPU temperature and average of 3 fan speeds
+    avg_fan_rpm = (float(fan_response['Fan1Pwm']) + float(fan_response['Fan2Pwm']) + float(fan_response['Fan3Pwm'])) / 3
+    emitter.add("mx2", {
+        "matrix_temperature": float(fan_response['MaximalCurrentTemperature']),
+        "matrix_fan_rpm": avg_fan_rpm,
+    }, {"source": host})
 
-    return results
 
+def uid_metrics(emitter: Emitter, host: str, uid_response: dict):
+    # read firmware version
+    emitter.add("mx2", {"matrix_info": 1}, {
+        "source": host,
+        "serial": uid_response["ProductSerialNumber"],
+        "firmware_version": uid_response["FirmwareVersion"],
+    })
 
-def get_properties(sock: socket.socket, cmd: str) -> list:
-    """Send command to device and return list of properties"""
-    signature = os.urandom(2).hex()
-    sock.sendall(f"{signature}#GET {cmd}.*\r\n".encode())
 
-    response = ""
-    for _ in range(100):
-        data = sock.recv(1024)
-        response += data.decode()
-        if data.decode().endswith("}\r\n") or data.decode() == "":
-            break
+def xp_metrics(emitter: Emitter, host: str, xp_response: dict, port_names: dict):
+    def tags(port: str) -> dict:
+        return {"source": host, "port": port, "port_name": port_names[port]}
 
-    results = {}
-    for line in response.strip()[7:-3].split("\r\n"):
-        try:
-            key = line.split(cmd)[1][1:].split("=")[0]
-            value = line.split(cmd)[1][1:].split("=")[1] or None
-            results[key] = value
-        except IndexError:
-            continue
-    return results
+    # metric for which input is routed to each destination
+    # value of 0 means no source is routed
+    for i, value in enumerate(xp_response["DestinationConnectionStatus"].split(";")[:-1]):
+        port = f"O{i+1}"
+        emitter.add("mx2", {"xpt_connection": 0 if value == '0' else int(value[1:])}, tags(port))
+
+    # metric for destination and source port locked/muted state
+    for prop, prefix, direction in [
+        ("DestinationPortStatus", "O", "dest"),
+        ("SourcePortStatus", "I", "src"),
+    ]:
+        for i, code in enumerate(xp_response[prop].split(";")[:-1]):
+            port = f"{prefix}{i+1}"
+            emitter.add("mx2", {
+                f"{direction}_locked": 0 if code[0] in ["T", "M"] else 1,
+                f"{direction}_muted": 0 if code[0] in ["T", "L"] else 1,
+            }, tags(port))
+
+
+def port_metrics(emitter: Emitter, host: str, port: str, port_name: str, status: dict):
+    """status is either the full STATUS or, for idle ports, only PORT_SUMMARY"""
+    tags = {"source": host, "port": port, "port_name": port_name}
+
+    emitter.add("mx2", {
+        field: converter(status[prop]) for prop, (field, converter) in PORT_FIELDS.items() if prop in status
+    }, tags)
+    if not all(prop in status for prop in [*PORT_CHANNEL_FIELDS, *PORT_INFO_TAGS]):
+        return
+
+    for ch in range(3):
+        emitter.add("mx2", {
+            field: to_binary(status[prop].split(";")[ch]) for prop, field in PORT_CHANNEL_FIELDS.items()
+        }, {**tags, "tmds_ch": str(ch)})
+
+    # add info metric with static value 1
+    emitter.add("mx2", {"info": 1}, {
+        **tags, **{tag: status[prop] for prop, tag in PORT_INFO_TAGS.items()}
+    })
+
+
+async def rename_port(host: str, state: dict, port: str, name: str):
+    """Apply a NAMES change to the state and the cached inventory, then write
+    the port's series in full, as every one of them is tagged by port_name"""
+    state[NAMES][port] = name
+    inventory = tiers.get("lightware_mx2", host)
+    if inventory is not None:
+        inventory[NAMES][port] = name
+        tiers.put("lightware_mx2", host, inventory)
+
+    emitter = Emitter()
+    if status_path(port) in state:
+        node_metrics(emitter, host, state, status_path(port))
+    xp = Emitter()
+    node_metrics(xp, host, state, XP)
+    for measurement, tags, timestamp, fields in xp.series():
+        if ("port", port) in tags:
+            emitter.add(measurement, fields, dict(tags), timestamp)
+    emitter.write()
+
+
+async def stream(host: str, heartbeat: float):
+    """Subscribe to every node and write line protocol for each change as it
+    arrives, plus the full state from memory every heartbeat seconds"""
+    client = await connect(host)
+    try:
+        state = await read_state(client, host)
+        await client.subscribe(list(state))
+        build_metrics(host, state).write()
+
+        loop = asyncio.get_running_loop()
+        next_heartbeat = loop.time() + heartbeat
+        while True:
+            try:
+                path, prop, value = await client.next_change(max(next_heartbeat - loop.time(), 0))
+            except asyncio.TimeoutError:
+                build_metrics(host, state).write()
+                next_heartbeat = loop.time() + heartbeat
+                continue
+
+            if path not in state or state[path].get(prop) == value:
+                continue
+            if path == NAMES:
+                await rename_port(host, state, prop, value)
+                continue
+
+            before, after = Emitter(), Emitter()
+            node_metrics(before, host, state, path)
+            state[path][prop] = value
+            if path.startswith(PORTS) and prop in PORT_SUMMARY:
+                # the port was idle or has just gone idle: read its full STATUS
+                status = await client.get_properties(path)
+                _port_status.setdefault(host, {})[path] = (status, time.monotonic())
+                state[path] = dict(status)
+            node_metrics(after, host, state, path)
+            after.diff(before).write()
+    finally:
+        await disconnect(client)
 
 
 if __name__ == "__main__":
@@ -319,8 +315,12 @@ if __name__ == "__main__":
     #     datefmt="%Y-%m-%d %H:%M:%S%z",
     # )
 
+    # example command: python3 lightware_mx2.py 192.168.20.13 stream
     try:
-        collect()
+        if len(sys.argv) == 3 and sys.argv[2] == 'stream':
+            asyncio.run(stream(sys.argv[1], HEARTBEAT))
+        else:
+            print(asyncio.run(collect(sys.argv[1])))
     except Exception as e:
         # logger.error(e, exc_info=True)
         raise SystemExit(e)
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Encode influx line protocol with cached series prefixes
+
+The escaped `measurement,tag=value,...` prefix of a series is the same on every
+poll, so it is built once per (measurement, tags) and cached. Lines are
+yielded from a generator and joined for a single write.
+"""
+
+import sys
+import math
+from functools import lru_cache
+
+_MEASUREMENT_ESCAPES = str.maketrans({"\\": "\\\\", " ": "\\ ", ",": "\\,"})
+_KEY_ESCAPES = str.maketrans({"\\": "\\\\", " ": "\\ ", ",": "\\,", "=": "\\="})
+_STRING_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
+@lru_cache(maxsize=65536)
+def series_prefix(measurement: str, tags: tuple) -> str:
+    """Escaped measurement and tags, where tags are sorted (name, value) pairs"""
+    prefix = measurement.translate(_MEASUREMENT_ESCAPES)
+    for name, value in tags:
+        if value != "":
+            prefix += f",{name.translate(_KEY_ESCAPES)}={value.translate(_KEY_ESCAPES)}"
+    return prefix
+
+
+def format_value(value) -> str:
+    value_type = type(value)
+    if value_type is int:
+        return f"{value}i"
+    if value_type is float:
+        return repr(value)
+    if value_type is bool:
+        return "true" if value else "false"
+    return f'"{str(value).translate(_STRING_ESCAPES)}"'
+
+
+def writable(value) -> bool:
+    """None and non-finite floats have no line protocol form; Telegraf would
+    reject the whole batch over a nan or inf"""
+    return value is not None and (type(value) is not float or math.isfinite(value))
+
+
+def encode(series):
+    """Yield one line per (measurement, tags, timestamp, fields). Fields which
+    are None, nan or inf are skipped, as are series left without any fields."""
+    for measurement, tags, timestamp, fields in series:
+        field_set = ",".join(
+            f"{name.translate(_KEY_ESCAPES)}={format_value(value)}"
+            for name, value in fields.items() if writable(value)
+        )
+        if not field_set:
+            continue
+        line = f"{series_prefix(measurement, tags)} {field_set}"
+        if timestamp is not None:
+            line += f" {timestamp}"
+        yield line
+
+
+def write(lines, stream=None):
+    """Write lines with one write() and flush"""
+    stream = stream or sys.stdout
+    output = "".join(f"{line}\n" for line in lines)
+    if output:
+        stream.write(output)
+        stream.flush()
@@ -0,0 +1,148 @@
+"""Pipelined client for the Lightware LW3 protocol
+
+Every command is prefixed with a random signature (`1a2b#GET /PATH.*`) which
+makes the device wrap its reply in a `{1a2b ... }` block. A whole batch of
+commands can therefore be written at once and the replies matched back to
+their commands by signature, so a batch costs about one round trip no matter
+how many ports it touches.
+
+Nodes can also be OPENed, after which the device pushes unsigned
+`CHG /PATH.Property=value` lines whenever a property changes.
+"""
+
+import os
+import asyncio
+
+from framing import LW3Framer
+
+PORT = 6107
+
+
+class LW3Client:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float = 10):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.changes = None
+        self._pending = {}
+        self._error = None
+        self._framer = LW3Framer()
+        self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, host: str, port: int = PORT, timeout: float = 10) -> "LW3Client":
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(reader, writer, timeout)
+
+    async def close(self):
+        self._read_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def send(self, commands: list) -> list:
+        """Send commands in one write and return the response lines of each"""
+        if self._error is not None:
+            raise ConnectionError(f"LW3 connection failed: {self._error!r}")
+
+        loop = asyncio.get_running_loop()
+        signatures = []
+        while len(signatures) < len(commands):
+            signature = os.urandom(2).hex()
+            if signature not in self._pending:
+                self._pending[signature] = loop.create_future()
+                signatures.append(signature)
+
+        try:
+            self.writer.write("".join(
+                f"{signature}#{cmd}\r\n" for signature, cmd in zip(signatures, commands)
+            ).encode())
+            await self.writer.drain()
+            futures = [self._pending[signature] for signature in signatures]
+            return await asyncio.wait_for(asyncio.gather(*futures), self.timeout)
+        finally:
+            for signature in signatures:
+                self._pending.pop(signature, None)
+
+    async def subscribe(self, paths: list):
+        """OPEN nodes so the device pushes CHG lines for them onto self.changes"""
+        if self.changes is None:
+            self.changes = asyncio.Queue()
+        for path, lines in zip(paths, await self.send([f"OPEN {path}" for path in paths])):
+            if not any(line.startswith("o") for line in lines):
+                raise LookupError(f"LW3 unable to open {path}: {' '.join(lines)}")
+
+    async def next_change(self, timeout: float = None) -> tuple:
+        """Wait for the next CHG line and return (path, property, value)"""
+        line = await asyncio.wait_for(self.changes.get(), timeout)
+        if line is None:
+            raise ConnectionError(f"LW3 connection failed: {self._error!r}")
+        _, path, prop, value = split_line(line)
+        return path, prop, value or None
+
+    async def _read_loop(self):
+        """Route {signature ... } blocks to the waiting send() and CHG lines to
+        self.changes. Blocks left over from an abandoned batch are dropped."""
+        try:
+            while True:
+                signature, lines = await self._framer.read(self.reader)
+                if signature is None:
+                    if lines.startswith("CHG ") and self.changes is not None:
+                        self.changes.put_nowait(lines)
+                    continue
+
+                future = self._pending.get(signature)
+                if future is not None and not future.done():
+                    future.set_result(lines)
+
+        except Exception as e:
+            self._error = e
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"LW3 connection failed: {e!r}"))
+            if self.changes is not None:
+                self.changes.put_nowait(None)
+
+    async def get(self, path: str) -> str:
+        return parse_value((await self.send([f"GET {path}"]))[0])
+
+    async def get_nodes(self, path: str) -> list:
+        return parse_nodes((await self.send([f"GET {path}"]))[0])
+
+    async def get_properties(self, path: str) -> dict:
+        return parse_properties((await self.send([f"GET {path}.*"]))[0])
+
+
+def split_line(line: str) -> tuple:
+    """Split a response line such as `pr /MEDIA/XP/VIDEO.Prop=value` into
+    (prefix, path, property, value)"""
+    prefix, _, rest = line.partition(" ")
+    name, _, value = rest.partition("=")
+    path, _, prop = name.rpartition(".")
+    return prefix, path, prop, value
+
+
+def parse_value(lines: list) -> str:
+    """Return the value of a single property GET"""
+    for line in lines:
+        prefix, _, _, value = split_line(line)
+        if prefix.startswith("p") and prefix != "pE":
+            return value
+    raise LookupError(f"LW3 error: {' '.join(lines)}")
+
+
+def parse_nodes(lines: list) -> list:
+    """Return the child node names from a node GET"""
+    return [line.split(" ", 1)[1].rsplit("/", 1)[1] for line in lines if line.startswith("n- ")]
+
+
+def parse_properties(lines: list) -> dict:
+    """Return {property: value} from a `GET /PATH.*`, with empty values as None"""
+    results = {}
+    for line in lines:
+        prefix, _, prop, value = split_line(line)
+        if prefix in ("pr", "pw") and prop:
+            results[prop] = value or None
+    return results
@@ -1,186 +1,38 @@
+"""Collect metrics from Planar VC9 video wall controllers
+
+The configuration is one large array of blocks. It is parsed as a stream and
+each block is dispatched by its class to a compiled extractor, so every block
+is visited once and never held with the rest. No metric needs another block,
+so there is no index of the document; benchmarks/bench_planar_vc9.py keeps
+the one-pass ConfigIndex it replaced, for comparison.
+"""
 from time import time_ns
-from influx_line_protocol import Metric
+from emitter import Emitter
+from jsonstream import iter_array
+import tiers
 import sys
-import requests
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-TIMESTAMP = time_ns()
-
-
-def power_outlet(block):
-    metric = Metric("planar_vc9_power_outlet")
-    metric.with_timestamp(TIMESTAMP)
-    metric.add_value("breaker_open", to_binary(block["attributes"]["breaker_open"]))
-    metric.add_value("current", float(block["attributes"]["current"] or -1))
-    metric.add_tag("power_distribution", block["relations"]["power_distribution"])
-    metric.add_tag("position", block["attributes"]["position"])
-    print(metric)
-
-
-def video_controller(block):
-    metric = Metric("planar_vc9_video_controller")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("genlock_status", block["attributes"]["genlock_status"])
-    metric.add_tag("input_board", block["relations"]["input_board"])
-    metric.add_tag("input_option", block["attributes"]["input_option"])
-    metric.add_tag("model_name", block["attributes"]["model_name"])
-    metric.add_tag("output_board", block["relations"]["output_board"])
-    metric.add_tag("output_mode", block["attributes"]["output_mode"])
-    metric.add_tag("output_option", block["attributes"]["output_option"])
-    metric.add_tag("package_version", block["attributes"]["package_version"])
-    metric.add_tag("serial_number", block["attributes"]["serial_number"])
-    metric.add_tag("version_fpga_main", block["attributes"]["version_fpga_main"])
-    metric.add_tag("version_micro", block["attributes"]["version_micro"])
+import asyncio
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 
-    metric.add_value("fan_speed_1", float(block["attributes"]["fan_speed_1"] or -1))
-    metric.add_value("fan_speed_2", float(block["attributes"]["fan_speed_2"] or -1))
-    metric.add_value("fan_status", block["attributes"]["fan_status"])
-    metric.add_value("fpga_temp", float(block["attributes"]["fpga_temp"] or -1))
-    metric.add_value("intake_temp", float(block["attributes"]["intake_temp"] or -1))
-    print(metric)
+# concurrent walls polled by fleet.py
+FLEET_CONCURRENCY = 4
+FLEET_SESSION = True
 
+URL = "https://{host}/api/full_configuration"
+HEADERS = {"Accept-Encoding": "gzip, deflate"}
+# seconds an idle connection is kept, longer than any poll interval
+KEEPALIVE = 300
+# seconds to wait for another process's fetch of the same wall, within half
+# the template's execd --timeout
+LOCK_WAIT = 8
 
-def system(block):
-    metric = Metric("planar_vc9_system")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("master", block["relations"]["master"])
-    metric.add_tag("package_version", block["attributes"]["package_version"])
-    metric.add_tag("panel_fw_version", block["attributes"]["panel_fw_version"])
-    metric.add_tag("preset_status", block["attributes"]["preset_status"])
-    metric.add_tag("wall", block["relations"]["wall"])
-
-    metric.add_value("active_preset", block["attributes"]["active_preset"])
-    print(metric)
-
-
-def power_rectifier(block):
-    metric = Metric("planar_vc9_power_rectifier")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("power_distribution", block["relations"]["power_distribution"])
-    metric.add_tag("position", block["attributes"]["position"])
-
-    metric.add_value("fan_fault_1", float(block["attributes"]["fan_fault_1"] or 0))
-    metric.add_value("fan_fault_2", float(block["attributes"]["fan_fault_2"] or 0))
-    metric.add_value("fan_speed_1", float(block["attributes"]["fan_speed_1"] or -1))
-    metric.add_value("fan_speed_2", float(block["attributes"]["fan_speed_2"] or -1))
-    metric.add_value("in_current", float(block["attributes"]["in_current"] or -1))
-    metric.add_value("in_voltage", float(block["attributes"]["in_voltage"] or -1))
-    metric.add_value("out_current", float(block["attributes"]["out_current"] or -1))
-    metric.add_value("out_voltage", float(block["attributes"]["out_voltage"] or -1))
-    metric.add_value("present", int(block["attributes"]["present"] or -1))
-    metric.add_value("state", int(block["attributes"]["state"] or -1))
-    metric.add_value("temp_ambient", float(block["attributes"]["temp_ambient"] or -1))
-    metric.add_value("valid", int(block["attributes"]["valid"] or -1))
-    print(metric)
-
-
-def panel(block):
-    metric = Metric("planar_vc9_panel")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("device_input", block["attributes"]["device_input"])
-    metric.add_tag("fw_version", block["attributes"]["fw_version"])
-    metric.add_tag("x", block["attributes"]["x"])
-    metric.add_tag("y", block["attributes"]["y"])
-
-    metric.add_value("connected", int(block["attributes"]["connected"] or -1))
-    metric.add_value("temperature", float(block["attributes"]["temperature"] or -1))
-    metric.add_value("voltage_24", float(block["attributes"]["voltage_24"] or -1))
-    metric.add_value("voltage_48", float(block["attributes"]["voltage_48"] or -1))
-    metric.add_value("watts", float(block["attributes"]["watts"] or -1))
-
-    print(metric)
-
-
-def power_supply(block):
-    metric = Metric("planar_vc9_power_supply")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("cpu_board", block["relations"]["cpu_board"])
-    metric.add_tag("name", block["attributes"]["name"])
-    metric.add_tag("power_distribution", block["relations"]["power_distribution"])
-    metric.add_tag("system", block["relations"]["system"])
-
-    metric.add_value("connected", int(block["attributes"]["connected"]))
-    metric.add_value("rtc_battery_ok", int(block["attributes"]["rtc_battery_ok"] or -1))
-    metric.add_value("temperature", float(block["attributes"]["temperature"] or -1))
-
-    print(metric)
-
-
-def planar_input(block):
-    # if block["relations"]["source_port"] is None:
-    #     return
-
-    metric = Metric("planar_vc9_input")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("source_port", block["relations"]["source_port"])
-    metric.add_tag("type", block["attributes"]["type"])
-    metric.add_tag("position", block["attributes"]["position"])
-
-    metric.add_value("connected", int(block["attributes"]["connected"] or -1))
-
-    print(metric)
-
-
-def source_port(block):
-    metric = Metric("planar_vc9_source_port")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("key", block["key"])
-    metric.add_tag("input", block["relations"]["input"])
-
-    metric.add_value("height", block["attributes"]["height"])
-    metric.add_value("pixel_depth", int(block["attributes"]["pixel_depth"]))
-    metric.add_value("source_presence", int(block["attributes"]["source_presence"]))
-
-    print(metric)
-
-
-def output_expansion(block):
-    metric = Metric("planar_vc9_output_expansion")
-    metric.with_timestamp(TIMESTAMP)
-
-    metric.add_tag("video_controller", block["relations"]["video_controller"])
-
-    metric.add_value("fpga_temp", float(block["attributes"]["fpga_temp"] or -1))
-
-    print(metric)
-
-
-def process(item_class, block):
-    processors = {
-        "Input": planar_input,
-        "OutputExpansion": output_expansion,
-        "Panel": panel,
-        "PowerOutlet": power_outlet,
-        "PowerRectifier": power_rectifier,
-        "PowerSupply": power_supply,
-        "System": system,
-        "VideoController": video_controller,
-        "SourcePort": source_port,
-    }
-    return processors.get(item_class)(block)
-
-
-def get_objects(data, item_class):
-    return [
-        process(item_class, data[i])
-        for i, block in enumerate(data)
-        if block["class"] == item_class
-    ]
 
 def to_binary(value) -> int:
     """Convert string/bool to integer where null/None is -1"""
     if type(value) is str:
-        if str.lower() in ["true", "1"]:
+        if value.lower() in ["true", "1"]:
             return 1
-        elif str.lower() in ["false", "0"]:
+        elif value.lower() in ["false", "0"]:
             return 0
         else:
             return -1
@@ -190,33 +42,228 @@ def to_binary(value) -> int:
         return -1
 
 
-def get_data():
-    host = sys.argv[1]
-    try:
-       req = requests.get(f"https://{host}/api/full_configuration", verify=False)
-       req.raise_for_status()
-       return req.json()["data"]
-    except Exception as e:
-       raise SystemExit(e)
-    # import json
-    # with open(sys.argv[1]) as f:
-    #     raw_data = f.read()
-    # return json.loads(raw_data)['data']
+def number(value) -> float:
+    """Float where null/None/empty is -1"""
+    return float(value or -1)
+
+
+def count(value) -> int:
+    """Integer where null/None/empty is -1"""
+    return int(value or -1)
+
+
+def fault(value) -> float:
+    """Float where null/None/empty is 0"""
+    return float(value or 0)
+
+
+def raw(value):
+    return value
+
+
+# class -> measurement, tags and fields. Tags are read from "attributes.<name>",
+# "relations.<name>" or the block's "key"; fields are attributes passed through
+# their converter.
+SCHEMA = {
+    "PowerOutlet": {
+        "measurement": "planar_vc9_power_outlet",
+        "tags": ["relations.power_distribution", "attributes.position"],
+        "fields": {"breaker_open": to_binary, "current": number},
+    },
+    "VideoController": {
+        "measurement": "planar_vc9_video_controller",
+        "tags": [
+            "attributes.genlock_status", "relations.input_board", "attributes.input_option",
+            "attributes.model_name", "relations.output_board", "attributes.output_mode",
+            "attributes.output_option", "attributes.package_version", "attributes.serial_number",
+            "attributes.version_fpga_main", "attributes.version_micro",
+        ],
+        "fields": {
+            "fan_speed_1": number, "fan_speed_2": number, "fan_status": raw,
+            "fpga_temp": number, "intake_temp": number,
+        },
+    },
+    "System": {
+        "measurement": "planar_vc9_system",
+        "tags": [
+            "relations.master", "attributes.package_version", "attributes.panel_fw_version",
+            "attributes.preset_status", "relations.wall",
+        ],
+        "fields": {"active_preset": raw},
+    },
+    "PowerRectifier": {
+        "measurement": "planar_vc9_power_rectifier",
+        "tags": ["relations.power_distribution", "attributes.position"],
+        "fields": {
+            "fan_fault_1": fault, "fan_fault_2": fault, "fan_speed_1": number, "fan_speed_2": number,
+            "in_current": number, "in_voltage": number, "out_current": number, "out_voltage": number,
+            "present": count, "state": count, "temp_ambient": number, "valid": count,
+        },
+    },
+    "Panel": {
+        "measurement": "planar_vc9_panel",
+        "tags": ["attributes.device_input", "attributes.fw_version", "attributes.x", "attributes.y"],
+        "fields": {
+            "connected": count, "temperature": number, "voltage_24": number,
+            "voltage_48": number, "watts": number,
+        },
+    },
+    "PowerSupply": {
+        "measurement": "planar_vc9_power_supply",
+        "tags": [
+            "relations.cpu_board", "attributes.name", "relations.power_distribution", "relations.system",
+        ],
+        "fields": {"connected": int, "rtc_battery_ok": count, "temperature": number},
+    },
+    "Input": {
+        "measurement": "planar_vc9_input",
+        "tags": ["relations.source_port", "attributes.type", "attributes.position"],
+        "fields": {"connected": count},
+    },
+    "OutputExpansion": {
+        "measurement": "planar_vc9_output_expansion",
+        "tags": ["relations.video_controller"],
+        "fields": {"fpga_temp": number},
+    },
+    "SourcePort": {
+        "measurement": "planar_vc9_source_port",
+        "tags": ["key", "relations.input"],
+        "fields": {"height": raw, "pixel_depth": int, "source_presence": int},
+    },
+}
+
+
+def compile_extractor(spec: dict):
+    """Turn one SCHEMA entry into a function of block -> (measurement, fields, tags)"""
+    measurement = spec["measurement"]
+    attribute_tags = [tag.split(".", 1)[1] for tag in spec["tags"] if tag.startswith("attributes.")]
+    relation_tags = [tag.split(".", 1)[1] for tag in spec["tags"] if tag.startswith("relations.")]
+    key_tag = "key" in spec["tags"]
+    fields = list(spec["fields"].items())
+
+    def extract(block: dict) -> tuple:
+        attributes = block["attributes"]
+        tags = {name: attributes[name] for name in attribute_tags}
+        if relation_tags:
+            relations = block["relations"]
+            for name in relation_tags:
+                tags[name] = relations[name]
+        if key_tag:
+            tags["key"] = block["key"]
+        return measurement, {name: convert(attributes[name]) for name, convert in fields}, tags
+
+    return extract
+
+
+PROCESSORS = {class_: compile_extractor(spec) for class_, spec in SCHEMA.items()}
+
+
+async def connect(host: str) -> ClientSession:
+    """Open an HTTP session which can be reused across polls. The connection
+    is kept alive well past the poll interval so TLS is only negotiated once."""
+    return ClientSession(
+        connector=TCPConnector(ssl=False, keepalive_timeout=KEEPALIVE),
+        timeout=ClientTimeout(total=15),
+    )
+
+
+async def disconnect(session: ClientSession):
+    await session.close()
+
+
+# host -> (ETag, Last-Modified, metrics) of the last full response
+_cache = {}
+
+
+def conditional_headers(host: str) -> dict:
+    etag, last_modified, _ = _cache.get(host, (None, None, None))
+    headers = dict(HEADERS)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+async def parse_metrics(host: str, resp, timestamp: int, keep: bool):
+    """Yield the metrics of a full response, keeping them in _cache with its
+    validators if keep is set and the wall sent any"""
+    resp.raise_for_status()
+    etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    metrics = [] if keep and (etag or last_modified) else None
+    async for block in iter_array(resp, "data"):
+        extract = PROCESSORS.get(block["class"])
+        if extract is not None:
+            metric = extract(block)
+            if metrics is not None:
+                metrics.append(metric)
+            yield (*metric, timestamp)
+    if metrics is None:
+        _cache.pop(host, None)
+    else:
+        _cache[host] = (etag, last_modified, metrics)
+
+
+async def iter_metrics(host: str, session: ClientSession, keep: bool = True):
+    """Yield (measurement, fields, tags, timestamp) per block as the
+    configuration is parsed. If keep is set and the wall sends ETag or
+    Last-Modified, the metrics are kept, the next poll is conditional and a
+    304 reuses them. stream() doesn't keep them, so its memory does not grow
+    with the size of the wall."""
+    timestamp = time_ns()
+    url = URL.format(host=host)
+    headers = conditional_headers(host) if keep else HEADERS
+    async with session.get(url, ssl=False, headers=headers) as resp:
+        if resp.status != 304:
+            async for metric in parse_metrics(host, resp, timestamp, keep):
+                yield metric
+            return
+        cached = _cache.get(host)
+    if cached is not None:
+        for metric in cached[2]:
+            yield (*metric, timestamp)
+        return
+    # a 304 with nothing kept to reuse: ask again without the validators
+    async with session.get(url, ssl=False, headers=HEADERS) as resp:
+        async for metric in parse_metrics(host, resp, timestamp, keep):
+            yield metric
+
+
+async def collect(host: str, conn: ClientSession = None) -> Emitter:
+    """Poll one wall. Opens and closes its own session unless conn is given.
+    Polls of the same wall from other processes within tiers.SHARED_TTL
+    reuse this one's metrics rather than the configuration itself. Those are
+    held whole, in memory and as JSON in tiers.CACHE_DIR; only stream() is
+    bounded by the size of a block."""
+    async def fetch():
+        session = conn or await connect(host)
+        try:
+            return [metric async for metric in iter_metrics(host, session)]
+        finally:
+            if conn is None:
+                await session.close()
+
+    emitter = Emitter()
+    for metric in await tiers.shared("planar_vc9", host, fetch, wait=LOCK_WAIT):
+        emitter.add(*metric)
+    return emitter
+
+
+async def stream(host: str):
+    """Write each block's line as soon as it is parsed"""
+    async with await connect(host) as session:
+        async for metric in iter_metrics(host, session, keep=False):
+            emitter = Emitter()
+            emitter.add(*metric)
+            emitter.write()
 
 
 if __name__ == "__main__":
-    data = get_data()
-    lines = []
-    classes = [
-        "PowerOutlet",
-        "VideoController",
-        "System",
-        "PowerRectifier",
-        "Panel",
-        "PowerSupply",
-        "Input",
-        "OutputExpansion",
-        "SourcePort",
-    ]
-    for class_ in classes:
-        get_objects(data, class_)
+    # usage: planar_vc9.py <host> [stream]
+    try:
+        if sys.argv[2:3] == ["stream"]:
+            asyncio.run(stream(sys.argv[1]))
+        else:
+            print(asyncio.run(collect(sys.argv[1])))
+    except Exception as e:
+        raise SystemExit(e)
@@ -0,0 +1,212 @@
+"""Poll devices once per interval and serve the latest results over HTTP
+
+Usage: python3 serve.py [--listen ADDR:PORT] [--interval S] [--timeout S] <script> <host|@file>...
+
+Each host is collected every interval by one resident collector, as execd.py
+would, with the polls spread evenly over the interval. Every consumer, such as
+a primary and a standby Telegraf or someone debugging with curl, reads the
+last result from memory, so a device sees the same load however many there
+are:
+
+    GET /metrics          every host
+    GET /metrics/<host>   one host, with an Age header
+    GET /status           JSON age, poll duration and last error per host
+
+Results are line protocol, for Telegraf inputs.http with data_format =
+"influx", or the Prometheus text format with ?format=prometheus or a
+Prometheus Accept header. Series carry the time they were polled, and each
+host gets an aragorn_poll metric with the result's age and the poll's
+duration. Results older than MAX_AGE intervals are not served. Hosts are
+given as for fleet.py.
+"""
+
+import re
+import sys
+import time
+import asyncio
+import argparse
+import importlib
+
+from aiohttp import web
+
+import lineprotocol
+from execd import Collector
+from fleet import read_hosts
+
+LISTEN = "127.0.0.1:9280"
+INTERVAL = 10
+# intervals after which a host's last result is dropped
+MAX_AGE = 3
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+_NAME_INVALID = re.compile(r"[^a-zA-Z0-9_:]")
+_LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+class Scheduler:
+    """Polls every host on its own schedule and keeps its last result"""
+
+    def __init__(self, module, targets: list, interval: float, timeout: float, concurrency: int):
+        self.name = module.__name__
+        self.collectors = {args[0]: Collector(module, args, timeout) for args in targets}
+        self.interval = interval
+        self.limit = asyncio.Semaphore(concurrency)
+        # host -> (emitter, polled at in ns, poll duration)
+        self.results = {}
+        self.errors = {}
+
+    async def run(self):
+        step = self.interval / max(len(self.collectors), 1)
+        await asyncio.gather(*(self.run_host(host, i * step) for i, host in enumerate(self.collectors)))
+
+    async def run_host(self, host: str, offset: float):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(offset)
+        next_poll = loop.time()
+        while True:
+            async with self.limit:
+                start = loop.time()
+                try:
+                    emitter = await self.collectors[host].collect()
+                except Exception as e:
+                    self.errors[host] = repr(e)
+                    print(f"{self.name} {host}: {e!r}", file=sys.stderr, flush=True)
+                else:
+                    emitter.tag_all("source", host)
+                    self.results[host] = (emitter, time.time_ns(), loop.time() - start)
+                    self.errors.pop(host, None)
+            # a poll which overran its interval delays the next one rather
+            # than running it straight away
+            next_poll = max(next_poll + self.interval, loop.time())
+            await asyncio.sleep(next_poll - loop.time())
+
+    def fresh(self, hosts) -> list:
+        """(host, emitter, polled, duration, age) of hosts with a recent result"""
+        now = time.time_ns()
+        fresh = []
+        for host in hosts:
+            if host in self.results:
+                emitter, polled, duration = self.results[host]
+                age = (now - polled) / 1e9
+                if age <= self.interval * MAX_AGE:
+                    fresh.append((host, emitter, polled, duration, age))
+        return fresh
+
+
+def metric_name(name: str) -> str:
+    name = _NAME_INVALID.sub("_", name)
+    return f"_{name}" if name[:1].isdigit() else name
+
+
+def influx(script: str, results: list) -> str:
+    def series():
+        for host, emitter, polled, duration, age in results:
+            for measurement, tags, timestamp, fields in emitter.series():
+                yield measurement, tags, timestamp or polled, fields
+            yield "aragorn_poll", (("script", script), ("source", host)), None, {
+                "age_seconds": round(age, 3), "duration_seconds": round(duration, 3),
+            }
+    return "".join(f"{line}\n" for line in lineprotocol.encode(series()))
+
+
+def prometheus(script: str, results: list) -> str:
+    """The Prometheus text format; string fields have no place in it and are
+    left out"""
+    samples = {}
+
+    def add(name: str, tags, value, timestamp: int = None):
+        labels = ",".join(f'{metric_name(key)}="{str(val).translate(_LABEL_ESCAPES)}"' for key, val in tags)
+        sample = f"{name}{{{labels}}} {value}"
+        if timestamp is not None:
+            sample += f" {timestamp // 1_000_000}"
+        samples.setdefault(name, []).append(sample)
+
+    for host, emitter, polled, duration, age in results:
+        for measurement, tags, timestamp, fields in emitter.series():
+            for field, value in fields.items():
+                if type(value) in (int, float, bool):
+                    add(metric_name(f"{measurement}_{field}"), tags, int(value) if type(value) is bool else value,
+                        timestamp or polled)
+        poll_tags = (("script", script), ("source", host))
+        add("aragorn_poll_age_seconds", poll_tags, round(age, 3))
+        add("aragorn_poll_duration_seconds", poll_tags, round(duration, 3))
+
+    return "".join(
+        f"# TYPE {name} untyped\n" + "".join(f"{sample}\n" for sample in lines)
+        for name, lines in samples.items()
+    )
+
+
+def wants_prometheus(request: web.Request) -> bool:
+    accept = request.headers.get("Accept", "")
+    return request.query.get("format") == "prometheus" or "version=0.0.4" in accept or "openmetrics" in accept
+
+
+def app(scheduler: Scheduler) -> web.Application:
+    def respond(request: web.Request, results: list) -> web.Response:
+        if wants_prometheus(request):
+            return web.Response(text=prometheus(scheduler.name, results), headers={"Content-Type": PROMETHEUS})
+        return web.Response(text=influx(scheduler.name, results), content_type="text/plain")
+
+    async def metrics(request: web.Request) -> web.Response:
+        return respond(request, scheduler.fresh(scheduler.collectors))
+
+    async def host_metrics(request: web.Request) -> web.Response:
+        host = request.match_info["host"]
+        if host not in scheduler.collectors:
+            raise web.HTTPNotFound(text=f"{host} is not polled here\n")
+        results = scheduler.fresh([host])
+        if not results:
+            raise web.HTTPServiceUnavailable(text=f"no recent result: {scheduler.errors.get(host, 'not polled yet')}\n")
+        response = respond(request, results)
+        response.headers["Age"] = str(int(results[0][4]))
+        return response
+
+    async def status(request: web.Request) -> web.Response:
+        now = time.time_ns()
+        hosts = {}
+        for host in scheduler.collectors:
+            _, polled, duration = scheduler.results.get(host, (None, None, None))
+            hosts[host] = {
+                "age": round((now - polled) / 1e9, 3) if polled else None,
+                "duration": round(duration, 3) if duration is not None else None,
+                "error": scheduler.errors.get(host),
+            }
+        return web.json_response({"script": scheduler.name, "interval": scheduler.interval, "hosts": hosts})
+
+    application = web.Application()
+    application.add_routes([
+        web.get("/metrics", metrics),
+        web.get("/metrics/{host}", host_metrics),
+        web.get("/status", status),
+    ])
+    return application
+
+
+async def serve(scheduler: Scheduler, listen: str):
+    host, _, port = listen.rpartition(":")
+    runner = web.AppRunner(app(scheduler))
+    await runner.setup()
+    await web.TCPSite(runner, host or None, int(port)).start()
+    try:
+        await scheduler.run()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", default=LISTEN, help="address:port to serve on")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between polls of each host")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds allowed per poll")
+    parser.add_argument("--concurrency", type=int, help="override the collector's FLEET_CONCURRENCY")
+    parser.add_argument("script", help="collector module name, e.g. lightware_mx2")
+    parser.add_argument("hosts", nargs="+", help="hosts, or @file with one host per line")
+    opts = parser.parse_args()
+
+    module = importlib.import_module(opts.script)
+    concurrency = opts.concurrency or getattr(module, "FLEET_CONCURRENCY", 8)
+    scheduler = Scheduler(module, read_hosts(opts.hosts), opts.interval, opts.timeout, concurrency)
+    try:
+        asyncio.run(serve(scheduler, opts.listen))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,230 @@
+"""Encoding and decoding of SNMPv1/v2c messages
+
+Only the BER subset SNMP uses: single byte tags, definite lengths. OIDs are
+tuples of ints, values (tag, value) pairs where value is an int, bytes, an
+OID tuple or None for NULL and the exception values. SNMPv1 traps are decoded
+into SNMPv2 form as RFC 3584 describes, so receivers only handle one kind.
+"""
+
+from collections import namedtuple
+
+# value tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+EXCEPTIONS = (NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW)
+
+# PDU tags
+GET = 0xA0
+GET_NEXT = 0xA1
+RESPONSE = 0xA2
+SET = 0xA3
+TRAP_V1 = 0xA4
+GET_BULK = 0xA5
+INFORM = 0xA6
+TRAP = 0xA7
+
+# error status
+NO_ERROR = 0
+TOO_BIG = 1
+
+VERSION_1 = 0
+VERSION_2C = 1
+
+# varbinds of SNMPv2 notifications
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+SNMP_TRAP_ENTERPRISE = (1, 3, 6, 1, 6, 3, 1, 1, 4, 3, 0)
+SNMP_TRAP_ADDRESS = (1, 3, 6, 1, 6, 3, 18, 1, 3, 0)
+# coldStart, warmStart, linkDown, ... are SNMP_TRAPS + (generic trap + 1,)
+SNMP_TRAPS = (1, 3, 6, 1, 6, 3, 1, 1, 5)
+ENTERPRISE_SPECIFIC = 6
+
+INTEGER_TAGS = (INTEGER, COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+BYTES_TAGS = (OCTET_STRING, IP_ADDRESS, OPAQUE)
+
+# For GET_BULK error_status and error_index carry non-repeaters and
+# max-repetitions
+Message = namedtuple("Message", "version community pdu request_id error_status error_index varbinds")
+
+
+def parse_oid(text: str) -> tuple:
+    return tuple(int(arc) for arc in text.strip(".").split("."))
+
+
+def format_oid(oid: tuple) -> str:
+    return "." + ".".join(map(str, oid))
+
+
+def tlv(tag: int, content: bytes) -> bytes:
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + content
+
+
+def encode_int(value: int) -> bytes:
+    return value.to_bytes(((value if value >= 0 else ~value).bit_length() + 8) // 8, "big", signed=True)
+
+
+def encode_oid(oid: tuple) -> bytes:
+    arcs = [oid[0] * 40 + oid[1], *oid[2:]]
+    content = bytearray()
+    for arc in arcs:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | arc & 0x7F)
+            arc >>= 7
+        content.extend(reversed(chunk))
+    return bytes(content)
+
+
+def encode_value(tag: int, value) -> bytes:
+    if tag in INTEGER_TAGS:
+        return tlv(tag, encode_int(value))
+    if tag == OBJECT_IDENTIFIER:
+        return tlv(tag, encode_oid(value))
+    if tag == NULL or tag in EXCEPTIONS:
+        return tlv(tag, b"")
+    return tlv(tag, bytes(value))
+
+
+def encode_varbinds(varbinds: list) -> bytes:
+    return tlv(SEQUENCE, b"".join(
+        tlv(SEQUENCE, tlv(OBJECT_IDENTIFIER, encode_oid(oid)) + encode_value(*value))
+        for oid, value in varbinds
+    ))
+
+
+def encode(message: Message) -> bytes:
+    pdu = tlv(
+        message.pdu,
+        tlv(INTEGER, encode_int(message.request_id))
+        + tlv(INTEGER, encode_int(message.error_status))
+        + tlv(INTEGER, encode_int(message.error_index))
+        + encode_varbinds(message.varbinds),
+    )
+    return tlv(
+        SEQUENCE,
+        tlv(INTEGER, encode_int(message.version)) + tlv(OCTET_STRING, message.community) + pdu,
+    )
+
+
+def encode_v1_trap(
+    community: bytes, enterprise: tuple, agent_address: bytes, generic: int, specific: int, uptime: int, varbinds: list
+) -> bytes:
+    pdu = tlv(
+        TRAP_V1,
+        tlv(OBJECT_IDENTIFIER, encode_oid(enterprise))
+        + tlv(IP_ADDRESS, agent_address)
+        + tlv(INTEGER, encode_int(generic))
+        + tlv(INTEGER, encode_int(specific))
+        + tlv(TIMETICKS, encode_int(uptime))
+        + encode_varbinds(varbinds),
+    )
+    return tlv(SEQUENCE, tlv(INTEGER, encode_int(VERSION_1)) + tlv(OCTET_STRING, community) + pdu)
+
+
+def read_tlv(data: bytes, pos: int) -> tuple:
+    """(tag, content, position after) of the element at pos"""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[pos:pos + size], "big")
+        pos += size
+    end = pos + length
+    if end > len(data):
+        raise ValueError("truncated message")
+    return tag, data[pos:end], end
+
+
+def decode_oid(content: bytes) -> tuple:
+    arcs = []
+    arc = 0
+    for byte in content:
+        arc = arc << 7 | byte & 0x7F
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    first = min(arcs[0] // 40, 2)
+    return (first, arcs[0] - first * 40, *arcs[1:])
+
+
+def decode_value(tag: int, content: bytes):
+    if tag == INTEGER:
+        return int.from_bytes(content, "big", signed=True)
+    if tag in INTEGER_TAGS:
+        return int.from_bytes(content, "big")
+    if tag == OBJECT_IDENTIFIER:
+        return decode_oid(content)
+    if tag == NULL or tag in EXCEPTIONS:
+        return None
+    return bytes(content)
+
+
+def decode_sequence(content: bytes) -> list:
+    """The (tag, content) elements of a constructed value"""
+    items = []
+    pos = 0
+    while pos < len(content):
+        tag, item, pos = read_tlv(content, pos)
+        items.append((tag, item))
+    return items
+
+
+def decode(data: bytes) -> Message:
+    tag, content, _ = read_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise ValueError(f"not an SNMP message: tag {tag:#x}")
+    (_, version), (_, community), (pdu, body) = decode_sequence(content)
+    fields = decode_sequence(body)
+    varbinds = decode_varbinds(fields[-1][1])
+    if pdu == TRAP_V1:
+        return Message(
+            decode_value(INTEGER, version), bytes(community), pdu, 0, 0, 0, v1_trap_varbinds(fields, varbinds)
+        )
+    request_id, error_status, error_index = (decode_value(INTEGER, item) for _, item in fields[:3])
+    return Message(
+        decode_value(INTEGER, version), bytes(community), pdu, request_id, error_status, error_index, varbinds
+    )
+
+
+def decode_varbinds(content: bytes) -> list:
+    varbinds = []
+    for _, varbind in decode_sequence(content):
+        (_, oid), (value_tag, value) = decode_sequence(varbind)
+        varbinds.append((decode_oid(oid), (value_tag, decode_value(value_tag, value))))
+    return varbinds
+
+
+def v1_trap_varbinds(fields: list, varbinds: list) -> list:
+    """The varbinds of an SNMPv2 notification for a v1 trap's enterprise,
+    agent-addr, generic-trap, specific-trap and time-stamp"""
+    enterprise = decode_oid(fields[0][1])
+    generic, specific, uptime = (decode_value(tag, item) for tag, item in fields[2:5])
+    if generic == ENTERPRISE_SPECIFIC:
+        trap_oid = enterprise + (0, specific)
+    else:
+        trap_oid = SNMP_TRAPS + (generic + 1,)
+    return [
+        (SYS_UPTIME, (TIMETICKS, uptime)),
+        (SNMP_TRAP_OID, (OBJECT_IDENTIFIER, trap_oid)),
+        *varbinds,
+        (SNMP_TRAP_ADDRESS, (IP_ADDRESS, bytes(fields[1][1]))),
+        (SNMP_TRAP_ENTERPRISE, (OBJECT_IDENTIFIER, enterprise)),
+    ]
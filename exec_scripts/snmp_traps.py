@@ -0,0 +1,405 @@
+"""Receive SNMP traps and informs and keep device alarm state current
+
+Usage: python3 snmp_traps.py [--port N] [--oids FILE] [--reconcile S] [--community C] [conf.d ...]
+       python3 snmp_traps.py send [--inform] [--v1] [--community C] <host[:port]> <trap> [object=value ...]
+
+Runs under Telegraf inputs.execd with signal = "none" and writes line protocol
+as traps arrive. Each trap becomes an snmp_trap metric, tagged with its name
+and MIB and with varbinds named from mibc.py's oids.json, plus the same Netbox
+tags the device's SNMP inputs carry in the rendered conf.d. Several conf.d
+can be given, and a shard root of tools/shard.py stands for all its shards,
+so one listener covers every Telegraf instance of the host. They're checked
+for changes every RELOAD seconds.
+
+Only traps from an agent of a rendered SNMP input, with that input's community
+or one given with --community, are accepted; anything else is dropped, so
+nobody else can make the listener send GETs. Port 162 is privileged, so the
+telegraf user needs CAP_NET_BIND_SERVICE (AmbientCapabilities= in its systemd
+unit), or traps can be redirected to an unprivileged --port.
+
+The alarm objects in ALARMS are no longer polled every interval. They're read
+from a device as soon as it sends a trap, and from every device of those
+templates every --reconcile seconds as a backstop for lost traps, and written
+under the measurement and field names the templates used. Informs are
+acknowledged. send emits a trap to try the listener, e.g.
+
+    python3 snmp_traps.py send 127.0.0.1:1162 BARCO-ME-DCP-MIB::fanSpeedFail BARCO-ME-DCP-MIB::eventSeverity=3
+
+which is only accepted if 127.0.0.1 is the agent of a rendered input.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tomllib
+
+import snmp_pdu as pdu
+from emitter import Emitter
+
+PORT = 162
+OIDS_FILE = "/usr/share/aragorn/oids.json"
+# where tools/render.py and tools/shard.py write the device configs; missing
+# ones are skipped
+CONF_DIRS = ["/etc/telegraf/telegraf.d", "/etc/telegraf/shards"]
+# seconds between checks of the conf.d for changes
+RELOAD = 30
+# seconds between reads of every device's alarms
+RECONCILE = 300
+GET_TIMEOUT = 3
+CONCURRENCY = 32
+# written by tools/render.py for grouped SNMP inputs
+TAGS_FILE = "netbox_snmp_tags.json"
+# objects of the SNMPv2 notification framework, which aren't in mibs/
+NOTIFICATION_OBJECTS = {pdu.SNMP_TRAP_ADDRESS: "snmpTrapAddress", pdu.SNMP_TRAP_ENTERPRISE: "snmpTrapEnterprise"}
+GENERIC_TRAPS = ["coldStart", "warmStart", "linkDown", "linkUp", "authenticationFailure", "egpNeighborLoss"]
+# alarm objects read on traps instead of polled, by the measurement of the
+# SNMP input which reports them
+ALARMS = {
+    "snmp_barco_projector": {
+        "projWarnings": "BARCO-ME-DCP-MIB::projWarnings.0",
+        "projErrors": "BARCO-ME-DCP-MIB::projErrors.0",
+        "projNotif": "BARCO-ME-DCP-MIB::projNotif.0",
+    },
+    "snmp_eaton_ups": {
+        "alarms": "XUPS-MIB::xupsAlarms.0",
+        "events_count": "XUPS-MIB::xupsAlarmNumEvents.0",
+    },
+}
+
+
+class Mib:
+    """Names, numeric OIDs and enums from mibc.py's oids.json"""
+
+    def __init__(self, path: str):
+        with open(path) as f:
+            self.objects = json.load(f)
+        self.by_oid = {pdu.parse_oid(node["oid"]): name for name, node in self.objects.items()}
+
+    def resolve(self, text: str) -> tuple:
+        """Numeric OID of MODULE::name.index, or of a numeric OID string"""
+        if "::" not in text:
+            return pdu.parse_oid(text)
+        name, _, index = text.partition(".")
+        return pdu.parse_oid(self.objects[name]["oid"]) + (pdu.parse_oid(index) if index else ())
+
+    def lookup(self, oid: tuple) -> tuple:
+        """(MODULE::name, index) of the longest known prefix of oid"""
+        for length in range(len(oid), 0, -1):
+            name = self.by_oid.get(oid[:length])
+            if name is not None:
+                return name, oid[length:]
+        return None, oid
+
+    def value(self, name: str, tag: int, value):
+        """A varbind value as Telegraf writes it: enum names, text for strings"""
+        enums = self.objects.get(name, {}).get("enums") if name else None
+        if enums and tag == pdu.INTEGER:
+            return enums.get(str(value), value)
+        if tag == pdu.OBJECT_IDENTIFIER:
+            return self.lookup(value)[0] or pdu.format_oid(value)
+        if tag == pdu.IP_ADDRESS:
+            return socket.inet_ntoa(value)
+        if isinstance(value, bytes):
+            return value.decode(errors="replace")
+        return value
+
+
+def conf_dirs(paths: list) -> list:
+    """The existing conf.d of paths, with each shard root's numbered shards"""
+    dirs = []
+    for path in paths:
+        if not os.path.isdir(path):
+            continue
+        dirs.append(path)
+        dirs.extend(
+            os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.isdigit() and os.path.isdir(os.path.join(path, name))
+        )
+    return dirs
+
+
+def load_inventory(dirs: list) -> tuple:
+    """({source: tags}, {source: target}, {source: {community}}) from the
+    rendered SNMP inputs, where a target has the measurement, SNMP settings
+    and port to read alarms with. Agents are resolved here, so this blocks and
+    is run off the event loop."""
+    tags, targets, communities = {}, {}, {}
+    for conf_dir in dirs:
+        load_conf_dir(conf_dir, tags, targets, communities)
+    return tags, targets, communities
+
+
+def load_conf_dir(conf_dir: str, tags: dict, targets: dict, communities: dict):
+    try:
+        with open(os.path.join(conf_dir, TAGS_FILE)) as f:
+            grouped_tags = json.load(f)
+    except (OSError, ValueError):
+        grouped_tags = {}
+    for source, source_tags in grouped_tags.items():
+        tags.setdefault(source, source_tags)
+    for name in sorted(os.listdir(conf_dir)):
+        if not (name.startswith("netbox_") and name.endswith(".conf")):
+            continue
+        try:
+            with open(os.path.join(conf_dir, name), "rb") as f:
+                config = tomllib.load(f)
+        except (OSError, tomllib.TOMLDecodeError):
+            continue
+        for snmp in config.get("inputs", {}).get("snmp", []):
+            for agent in snmp.get("agents", []):
+                host, _, port = agent.split("://")[-1].partition(":")
+                try:
+                    source = socket.gethostbyname(host)
+                except OSError as e:
+                    print(f"{name}: skipping agent {agent}: {e}", file=sys.stderr, flush=True)
+                    continue
+                source_tags = {**snmp.get("tags", {}), **grouped_tags.get(source, {})}
+                tags.setdefault(source, source_tags)
+                communities.setdefault(source, set())
+                if snmp.get("version", 2) != 3:
+                    communities[source].add(snmp.get("community", "public").encode())
+                measurement = snmp.get("name_override")
+                if measurement in ALARMS:
+                    targets[source] = {
+                        "measurement": measurement,
+                        "port": int(port or 161),
+                        "version": pdu.VERSION_1 if snmp.get("version") == 1 else pdu.VERSION_2C,
+                        "community": snmp.get("community", "public").encode(),
+                        "tags": source_tags,
+                    }
+
+
+def trap_metrics(mib: Mib, source: str, message: pdu.Message, tags: dict) -> Emitter:
+    fields = {}
+    trap_oid = None
+    for oid, (tag, value) in message.varbinds:
+        if oid == pdu.SNMP_TRAP_OID:
+            trap_oid = value
+        elif oid == pdu.SYS_UPTIME:
+            fields["sysUpTimeInstance"] = value
+        elif oid in NOTIFICATION_OBJECTS:
+            fields[NOTIFICATION_OBJECTS[oid]] = mib.value(None, tag, value)
+        elif tag not in pdu.EXCEPTIONS:
+            name, _ = mib.lookup(oid)
+            fields[name.partition("::")[2] if name else pdu.format_oid(oid)] = mib.value(name, tag, value)
+
+    name, _ = mib.lookup(trap_oid or ())
+    if name:
+        module, _, trap = name.partition("::")
+    elif trap_oid and trap_oid[:-1] == pdu.SNMP_TRAPS and 0 < trap_oid[-1] <= len(GENERIC_TRAPS):
+        module, trap = "SNMPv2-MIB", GENERIC_TRAPS[trap_oid[-1] - 1]
+    else:
+        module, trap = "", pdu.format_oid(trap_oid or ())
+    emitter = Emitter()
+    emitter.add("snmp_trap", fields, {
+        **tags,
+        "source": source,
+        "name": trap,
+        "mib": module,
+        "oid": pdu.format_oid(trap_oid or ()),
+        "version": "1" if message.version == pdu.VERSION_1 else "2c",
+    }, time.time_ns())
+    return emitter
+
+
+class Requester(asyncio.DatagramProtocol):
+    """SNMP GETs over one socket, matched to their requests by request-id"""
+
+    def __init__(self):
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            response = pdu.decode(data)
+        except (ValueError, IndexError):
+            return
+        future = self.pending.pop(response.request_id, None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    async def get(self, host: str, port: int, version: int, community: bytes, oids: list) -> list:
+        request_id = random.randrange(1, 2**31)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        message = pdu.Message(version, community, pdu.GET, request_id, 0, 0, [(oid, (pdu.NULL, None)) for oid in oids])
+        self.transport.sendto(pdu.encode(message), (host, port))
+        try:
+            response = await asyncio.wait_for(future, GET_TIMEOUT)
+        finally:
+            self.pending.pop(request_id, None)
+        return response.varbinds
+
+
+class Listener(asyncio.DatagramProtocol):
+    """Receives notifications and reads alarm state from their senders"""
+
+    def __init__(self, mib: Mib, conf_paths: list, trap_communities: list = ()):
+        self.mib = mib
+        self.conf_paths = conf_paths
+        self.trap_communities = {community.encode() for community in trap_communities}
+        self.loaded = None
+        self.tags, self.targets, self.communities = {}, {}, {}
+        # sources already reported as dropped, so a chatty one isn't logged per trap
+        self.dropped = set()
+        self.reading = set()
+        self.limit = asyncio.Semaphore(CONCURRENCY)
+
+    async def start(self, port: int):
+        loop = asyncio.get_running_loop()
+        _, self.requester = await loop.create_datagram_endpoint(Requester, local_addr=("0.0.0.0", 0))
+        await loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", port))
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    async def reload(self):
+        """Reread the conf.d inventory if render.py changed it"""
+        dirs = conf_dirs(self.conf_paths)
+        loaded = [(conf_dir, os.stat(conf_dir).st_mtime_ns) for conf_dir in dirs]
+        if loaded != self.loaded:
+            inventory = await asyncio.get_running_loop().run_in_executor(None, load_inventory, dirs)
+            self.tags, self.targets, self.communities = inventory
+            self.loaded = loaded
+
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload()
+            except OSError as e:
+                print(f"reloading the conf.d: {e!r}", file=sys.stderr, flush=True)
+
+    def accepted(self, source: str, community: bytes) -> bool:
+        """Whether source is a configured agent using its community"""
+        allowed = self.communities.get(source)
+        if allowed is not None and (community in allowed or community in self.trap_communities):
+            return True
+        if source not in self.dropped:
+            self.dropped.add(source)
+            reason = "community mismatch" if source in self.communities else "not a configured agent"
+            print(f"dropping traps from {source}: {reason}", file=sys.stderr, flush=True)
+        return False
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            message = pdu.decode(data)
+        except (ValueError, IndexError):
+            return
+        if message.pdu not in (pdu.TRAP, pdu.TRAP_V1, pdu.INFORM):
+            return
+        source = addr[0]
+        if not self.accepted(source, message.community):
+            return
+        self.dropped.discard(source)
+        if message.pdu == pdu.INFORM:
+            self.transport.sendto(pdu.encode(message._replace(pdu=pdu.RESPONSE)), addr)
+        trap_metrics(self.mib, source, message, self.tags.get(source, {})).write()
+        if source in self.targets and source not in self.reading:
+            asyncio.ensure_future(self.read_alarms(source))
+
+    async def read_alarms(self, source: str):
+        target = self.targets[source]
+        fields = ALARMS[target["measurement"]]
+        self.reading.add(source)
+        try:
+            async with self.limit:
+                varbinds = await self.requester.get(
+                    source, target["port"], target["version"], target["community"],
+                    [self.mib.resolve(oid) for oid in fields.values()],
+                )
+        except (asyncio.TimeoutError, OSError):
+            return
+        finally:
+            self.reading.discard(source)
+        values = {
+            field: self.mib.value(None, tag, value)
+            for field, (_, (tag, value)) in zip(fields, varbinds) if tag not in pdu.EXCEPTIONS
+        }
+        emitter = Emitter()
+        emitter.add(target["measurement"], values, {**target["tags"], "source": source})
+        emitter.write()
+
+    async def reconcile(self, interval: float):
+        while True:
+            await asyncio.gather(*(
+                self.read_alarms(source) for source in list(self.targets) if source not in self.reading
+            ))
+            await asyncio.sleep(interval)
+
+
+async def listen(port: int, oids: str, conf_paths: list, reconcile: float, communities: list):
+    listener = Listener(Mib(oids), conf_paths, communities)
+    await listener.reload()
+    await listener.start(port)
+    await asyncio.gather(listener.watch(RELOAD), listener.reconcile(reconcile))
+
+
+def send(
+    address: str, trap: str, objects: list, mib: Mib, inform: bool = False, v1: bool = False, community: str = "public"
+):
+    """Send one notification with objects given as name=value, integers or
+    strings, and wait for an inform's acknowledgement"""
+    host, _, port = address.partition(":")
+    varbinds = []
+    for item in objects:
+        name, _, value = item.partition("=")
+        varbinds.append((
+            mib.resolve(name),
+            (pdu.INTEGER, int(value)) if value.lstrip("-").isdigit() else (pdu.OCTET_STRING, value.encode()),
+        ))
+    trap_oid = mib.resolve(trap)
+    uptime = int(time.monotonic() * 100) % 2**32
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if v1:
+        # enterprise.0.specific, as mibc.py resolves TRAP-TYPEs
+        data = pdu.encode_v1_trap(
+            community.encode(), trap_oid[:-2], socket.inet_aton("127.0.0.1"), 6, trap_oid[-1], uptime, varbinds
+        )
+    else:
+        data = pdu.encode(pdu.Message(
+            pdu.VERSION_2C, community.encode(), pdu.INFORM if inform else pdu.TRAP, random.randrange(1, 2**31), 0, 0,
+            [(pdu.SYS_UPTIME, (pdu.TIMETICKS, uptime)), (pdu.SNMP_TRAP_OID, (pdu.OBJECT_IDENTIFIER, trap_oid)),
+             *varbinds],
+        ))
+    sock.sendto(data, (host, int(port or PORT)))
+    if inform:
+        sock.settimeout(GET_TIMEOUT)
+        response = pdu.decode(sock.recv(65535))
+        print(f"acknowledged {response.request_id}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["send"]:
+        parser = argparse.ArgumentParser(description="send an SNMP trap")
+        parser.add_argument("--oids", default=OIDS_FILE, help="oids.json from tools/mibc.py")
+        parser.add_argument("--inform", action="store_true", help="send an inform and wait for the response")
+        parser.add_argument("--v1", action="store_true", help="send an SNMPv1 trap")
+        parser.add_argument("--community", default="public")
+        parser.add_argument("address", help="host[:port] of the listener")
+        parser.add_argument("trap", help="MODULE::name of the notification")
+        parser.add_argument("objects", nargs="*", help="MODULE::name.index=value")
+        opts = parser.parse_args(sys.argv[2:])
+        send(opts.address, opts.trap, opts.objects, Mib(opts.oids), opts.inform, opts.v1, opts.community)
+        raise SystemExit
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--oids", default=OIDS_FILE, help="oids.json from tools/mibc.py")
+    parser.add_argument("--reconcile", type=float, default=RECONCILE, help="seconds between alarm reads")
+    parser.add_argument("--community", action="append", default=[],
+                        help="trap community accepted from any configured agent, besides its input's own")
+    parser.add_argument("conf_dirs", nargs="*", default=CONF_DIRS,
+                        help="rendered conf.d or shard roots, for device tags and alarm targets")
+    opts = parser.parse_args()
+    try:
+        asyncio.run(listen(opts.port, opts.oids, opts.conf_dirs, opts.reconcile, opts.community))
+    except Exception as e:
+        raise SystemExit(e)
@@ -0,0 +1,134 @@
+"""Cache slow-tier device data between polls
+
+Inventory such as port names, port lists and model configs changes far less
+often than live telemetry. Collectors store it here with a TTL and skip those
+requests on the polls in between. Entries are kept in process, for resident
+collectors under execd, and as JSON under CACHE_DIR, so one-shot runs share
+them too. If CACHE_DIR can't be written the cache is in-process only.
+
+shared() is the same cache for live data with a TTL of seconds: when several
+Telegraf instances or overlapping intervals poll a host at once, one process
+fetches under a lock on the entry and the others wait for and reuse its result.
+"""
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+import asyncio
+
+CACHE_DIR = "/run/aragorn"
+# seconds slow-tier data is reused for
+SLOW_TTL = 3600
+# seconds a shared live result is reused for, well below any poll interval
+SHARED_TTL = 2
+# seconds to wait for another process's fetch before fetching anyway. It has
+# to end well inside the caller's poll timeout (execd --timeout, 5 s for the
+# shortest template), or the waiter is cancelled before it can fetch itself.
+LOCK_WAIT = 2
+
+# (namespace, host) -> (expires, value)
+_memory = {}
+
+
+def cache_path(namespace: str, host: str) -> str:
+    return os.path.join(CACHE_DIR, namespace, f"{host}.json")
+
+
+def get(namespace: str, host: str):
+    """Return the cached value, or None if it is missing or expired. Another
+    process may have refreshed the file, so it is read when the in-process
+    entry is missing or expired."""
+    now = time.time()
+    entry = _memory.get((namespace, host))
+    if entry is None or entry[0] <= now:
+        try:
+            with open(cache_path(namespace, host)) as f:
+                stored = json.load(f)
+            entry = _memory[(namespace, host)] = (stored["expires"], stored["value"])
+        except (OSError, ValueError, KeyError):
+            return None
+    if entry[0] <= now:
+        return None
+    return entry[1]
+
+
+def put(namespace: str, host: str, value, ttl: float = SLOW_TTL):
+    """Store a JSON-serialisable value for ttl seconds"""
+    expires = time.time() + ttl
+    _memory[(namespace, host)] = (expires, value)
+    path = cache_path(namespace, host)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a temporary file of its own, as other processes write the same entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"expires": expires, "value": value}, f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def invalidate(namespace: str, host: str):
+    _memory.pop((namespace, host), None)
+    try:
+        os.remove(cache_path(namespace, host))
+    except OSError:
+        pass
+
+
+async def cached(namespace: str, host: str, fetch, ttl: float = SLOW_TTL):
+    """Return get(), or await fetch() and put() its result on a miss"""
+    value = get(namespace, host)
+    if value is None:
+        value = await fetch()
+        put(namespace, host, value, ttl)
+    return value
+
+
+async def lock(namespace: str, host: str, wait: float = LOCK_WAIT):
+    """Take the entry's lock file, polling so the event loop keeps running.
+    Returns the open file holding the lock, or None if it couldn't be had."""
+    path = f"{cache_path(namespace, host)}.lock"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, "a")
+    except OSError:
+        return None
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                f.close()
+                return None
+            await asyncio.sleep(0.05)
+
+
+async def shared(namespace: str, host: str, fetch, ttl: float = SHARED_TTL, wait: float = LOCK_WAIT):
+    """Like cached(), but concurrent callers in any process wait up to wait
+    seconds for one fetch instead of each making their own"""
+    value = get(namespace, host)
+    if value is not None:
+        return value
+    held = await lock(namespace, host, wait)
+    try:
+        # whoever held the lock before may have just fetched it
+        value = get(namespace, host)
+        if value is None:
+            value = await fetch()
+            put(namespace, host, value, ttl)
+        return value
+    finally:
+        if held is not None:
+            held.close()
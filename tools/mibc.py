@@ -0,0 +1,365 @@
+"""Compile the MIBs the templates use into numeric OIDs and a pruned MIB set
+
+Usage: python3 mibc.py [--mibs DIR] [--templates DIR] <output dir>
+
+Parses every MIB in mibs/ once and resolves each object to its numeric OID,
+with its syntax, enum values, access, table index and notification objects.
+Writes <output dir>/oids.json, {"MODULE::name": {"oid": ".1.3.6...", ...}},
+for every object of the modules the templates reference, and copies only
+those modules and what they import into <output dir>/mibs/. Pointing MIBDIRS
+there keeps Telegraf from loading the whole vendor library on every start,
+and render.py --oids uses oids.json to write numeric OIDs into the rendered
+configs. Fails if a template references an object no MIB defines.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+
+MIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mibs")
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "telegraf_templates")
+ROOTS = {"ccitt": [0], "iso": [1], "joint-iso-ccitt": [2]}
+# macros whose value is an OID
+MACROS = {
+    "OBJECT-TYPE", "MODULE-IDENTITY", "OBJECT-IDENTITY", "NOTIFICATION-TYPE", "OBJECT-GROUP",
+    "NOTIFICATION-GROUP", "MODULE-COMPLIANCE", "AGENT-CAPABILITIES",
+}
+# symbolic OIDs in templates, e.g. oid = 'BARCO-ME-DCP-MIB::lampRunTime.1'
+REFERENCE = re.compile(r"""\boid\s*=\s*(['"])([\w-]+)::([\w-]+)((?:\.\d+)*)\1""")
+
+TOKEN = re.compile(
+    r'"[^"]*"'  # string, may span lines
+    r"|--(?:[^-\n]|-(?!-))*(?:--|$)"  # comment, to the next -- or end of line
+    r"|'[0-9A-Fa-f]*'[HhBb]"
+    r"|::=|\.\."
+    r"|[A-Za-z][\w]*(?:-[\w]+)*"
+    r"|-?\d+"
+    r"|[{}()\[\],;|.]",
+    re.MULTILINE,
+)
+
+
+def tokenize(source: str) -> list:
+    return [token for token in TOKEN.findall(source) if not token.startswith("--")]
+
+
+class Parser:
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset: int = 0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def skip_braces(self, open: str = "{", close: str = "}"):
+        """Skip a balanced group starting at the current token"""
+        depth = 0
+        while self.peek() is not None:
+            token = self.next()
+            if token == open:
+                depth += 1
+            elif token == close:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def named_numbers(self) -> dict:
+        """{ name(1), other(2) } as {"1": "name", ...}"""
+        numbers = {}
+        self.next()
+        while self.peek() not in ("}", None):
+            token = self.next()
+            if self.peek() == "(":
+                self.next()
+                numbers[self.next()] = token
+                self.next()
+        self.next()
+        return numbers
+
+    def names(self) -> list:
+        """{ a, b, c } as a list"""
+        self.next()
+        names = []
+        while self.peek() not in ("}", None):
+            token = self.next()
+            if token != ",":
+                names.append(token)
+        self.next()
+        return names
+
+    def syntax(self) -> dict:
+        """A type: its name, and enum values or the entry type of a table"""
+        while self.peek() == "[":
+            self.skip_braces("[", "]")
+        if self.peek() == "IMPLICIT":
+            self.next()
+        name = self.next()
+        result = {}
+        if name in ("OCTET", "OBJECT"):
+            name = f"{name} {self.next()}"
+        elif name == "SEQUENCE" and self.peek() == "OF":
+            self.next()
+            result["entry"] = self.next()
+        elif name in ("SEQUENCE", "CHOICE"):
+            self.skip_braces()
+        result["type"] = name
+        if self.peek() == "{" and name in ("INTEGER", "BITS") or self.peek() == "{" and name[0].isupper() and self.peek(2) == "(":
+            result["enums"] = self.named_numbers()
+        if self.peek() == "(":
+            self.skip_braces("(", ")")
+        return result
+
+    def oid_value(self) -> list:
+        """{ parent 1 2 } or { iso org(3) 6 } as [parent, 1, 2]"""
+        self.next()
+        parts = []
+        while self.peek() not in ("}", None):
+            token = self.next()
+            if self.peek() == "(":
+                self.next()
+                token = self.next()
+                self.next()
+            parts.append(int(token) if token.lstrip("-").isdigit() else token)
+        self.next()
+        return parts
+
+
+def parse_module(parser: Parser, name: str = "") -> dict:
+    """Parse from after BEGIN to END: imports, OID assignments and types.
+    Definitions which can't be parsed are reported and left out."""
+    module = {"imports": {}, "nodes": {}, "types": {}}
+    while parser.peek() not in ("END", None):
+        token = parser.next()
+        following = parser.peek()
+        if token == "IMPORTS":
+            symbols = []
+            while parser.peek() not in (";", None):
+                symbol = parser.next()
+                if symbol == "FROM":
+                    source = parser.next()
+                    for name in symbols:
+                        module["imports"][name] = source
+                    symbols = []
+                elif symbol != ",":
+                    symbols.append(symbol)
+            parser.next()
+        elif token == "EXPORTS":
+            while parser.next() not in (";", None):
+                pass
+        elif following == "MACRO":
+            while parser.next() not in ("END", None):
+                pass
+        elif following == "OBJECT" and parser.peek(1) == "IDENTIFIER" and parser.peek(2) == "::=":
+            parser.pos += 3
+            module["nodes"][token] = {"value": parser.oid_value()}
+        elif following in MACROS:
+            parser.next()
+            node = {"macro": following}
+            while parser.peek() not in ("::=", None):
+                clause = parser.next()
+                if clause == "SYNTAX" and following == "OBJECT-TYPE":
+                    node.update(parser.syntax())
+                elif clause in ("MAX-ACCESS", "ACCESS"):
+                    node["access"] = parser.next()
+                elif clause == "INDEX":
+                    node["index"] = [name for name in parser.names() if name != "IMPLIED"]
+                elif clause in ("OBJECTS", "VARIABLES") and parser.peek() == "{":
+                    node["objects"] = parser.names()
+            parser.next()
+            node["value"] = parser.oid_value()
+            module["nodes"][token] = node
+        elif following == "TRAP-TYPE":
+            # SNMPv1 trap: enterprise.0.number in SNMPv2 terms
+            parser.next()
+            node = {"macro": following}
+            enterprise = None
+            while parser.peek() not in ("::=", None):
+                clause = parser.next()
+                if clause == "ENTERPRISE":
+                    enterprise = parser.next()
+                elif clause == "VARIABLES":
+                    node["objects"] = parser.names()
+            parser.next()
+            number = parser.next()
+            if enterprise is None or number is None or not number.isdigit():
+                print(f"{name}::{token}: TRAP-TYPE without ENTERPRISE or trap number, skipped", file=sys.stderr)
+                continue
+            node["value"] = [enterprise, 0, int(number)]
+            module["nodes"][token] = node
+        elif following == "::=" and token[0].isupper():
+            parser.next()
+            if parser.peek() == "TEXTUAL-CONVENTION":
+                while parser.peek() not in ("SYNTAX", None):
+                    parser.next()
+                parser.next()
+            module["types"][token] = parser.syntax()
+    parser.next()
+    return module
+
+
+def parse(source: str) -> dict:
+    """{module name: module} for every module in a MIB file"""
+    parser = Parser(tokenize(source))
+    modules = {}
+    while parser.peek() is not None:
+        token = parser.next()
+        if parser.peek() == "DEFINITIONS":
+            while parser.next() not in ("BEGIN", None):
+                pass
+            modules[token] = parse_module(parser, token)
+    return modules
+
+
+class Mibs:
+    """Every module of a MIB directory, with OIDs and types resolved across
+    imports"""
+
+    def __init__(self, mib_dir: str = MIB_DIR):
+        self.modules = {}
+        self.files = {}
+        for name in sorted(os.listdir(mib_dir)):
+            path = os.path.join(mib_dir, name)
+            with open(path, errors="replace") as f:
+                for module_name, module in parse(f.read()).items():
+                    self.modules[module_name] = module
+                    self.files[module_name] = path
+        self._oids = {}
+
+    def find(self, module_name: str, name: str, kind: str = "nodes"):
+        """The module which defines a symbol as seen from module_name,
+        following its imports, or any module defining it"""
+        seen = set()
+        while module_name in self.modules and module_name not in seen:
+            seen.add(module_name)
+            module = self.modules[module_name]
+            if name in module[kind]:
+                return module_name
+            module_name = module["imports"].get(name)
+        for other, module in self.modules.items():
+            if name in module[kind]:
+                return other
+        return None
+
+    def oid(self, module_name: str, name: str) -> list:
+        key = (module_name, name)
+        if key not in self._oids:
+            if name in ROOTS:
+                self._oids[key] = ROOTS[name]
+            else:
+                defined = self.find(module_name, name)
+                if defined is None:
+                    raise KeyError(f"{module_name}::{name}")
+                parent, *numbers = self.modules[defined]["nodes"][name]["value"]
+                if isinstance(parent, int):
+                    self._oids[key] = [parent, *numbers]
+                else:
+                    self._oids[key] = self.oid(defined, parent) + numbers
+        return self._oids[key]
+
+    def enums(self, module_name: str, syntax: dict):
+        """Enum values of a syntax, following textual conventions"""
+        seen = set()
+        while "enums" not in syntax and syntax.get("type") not in seen:
+            seen.add(syntax.get("type"))
+            defined = self.find(module_name, syntax.get("type"), "types")
+            if defined is None:
+                return None
+            module_name, syntax = defined, self.modules[defined]["types"][syntax["type"]]
+        return syntax.get("enums")
+
+    def describe(self, module_name: str, name: str) -> dict:
+        """The numeric OID and syntax of one object"""
+        node = self.modules[module_name]["nodes"][name]
+        result = {"oid": "." + ".".join(map(str, self.oid(module_name, name)))}
+        if "type" in node:
+            result["type"] = node["type"]
+            enums = self.enums(module_name, node)
+            if enums:
+                result["enums"] = enums
+        for key in ("access", "index", "objects"):
+            if key in node:
+                result[key] = [
+                    f"{self.find(module_name, object_name)}::{object_name}" for object_name in node[key]
+                ] if key != "access" else node[key]
+        if node.get("macro") in ("NOTIFICATION-TYPE", "TRAP-TYPE"):
+            result["notification"] = True
+        return result
+
+    def requires(self, module_names: set) -> set:
+        """The modules plus everything they import, transitively"""
+        needed = set()
+        pending = [name for name in module_names if name in self.modules]
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(source for source in self.modules[name]["imports"].values() if source in self.modules)
+        return needed
+
+
+def references(template_dir: str = TEMPLATE_DIR) -> set:
+    """(module, name) of every symbolic OID in the templates"""
+    found = set()
+    for name in sorted(os.listdir(template_dir)):
+        if name.endswith(".conf"):
+            with open(os.path.join(template_dir, name)) as f:
+                found.update((module, symbol) for _, module, symbol, _ in REFERENCE.findall(f.read()))
+    return found
+
+
+def compile_oids(mibs: Mibs, modules: set) -> dict:
+    """Every object of the given modules, by MODULE::name"""
+    oids = {}
+    for module_name in sorted(modules):
+        for name in mibs.modules[module_name]["nodes"]:
+            try:
+                oids[f"{module_name}::{name}"] = mibs.describe(module_name, name)
+            except KeyError as e:
+                print(f"{module_name}::{name}: unresolved {e}", file=sys.stderr)
+    return oids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mibs", default=MIB_DIR, help="MIB directory")
+    parser.add_argument("--templates", default=TEMPLATE_DIR, help="template directory")
+    parser.add_argument("output", help="directory for oids.json and the pruned mibs/")
+    opts = parser.parse_args()
+
+    mibs = Mibs(opts.mibs)
+    wanted = references(opts.templates)
+    missing = sorted(f"{module}::{name}" for module, name in wanted if mibs.find(module, name) is None)
+    for name in missing:
+        print(f"{name}: not defined in any MIB", file=sys.stderr)
+
+    used = {mibs.find(module, name) for module, name in wanted} - {None}
+    needed = mibs.requires(used)
+    oids = compile_oids(mibs, used)
+
+    mib_out = os.path.join(opts.output, "mibs")
+    # the pruned set replaces everything in mib_out, which mustn't be where
+    # the MIBs come from
+    if os.path.realpath(mib_out) in {os.path.realpath(os.path.dirname(path)) for path in mibs.files.values()}:
+        raise SystemExit(f"{mib_out} is the MIB source directory, choose another output")
+    os.makedirs(mib_out, exist_ok=True)
+    for name in os.listdir(mib_out):
+        os.remove(os.path.join(mib_out, name))
+    for path in sorted({mibs.files[name] for name in needed}):
+        shutil.copy(path, mib_out)
+    with open(os.path.join(opts.output, "oids.json.tmp"), "w") as f:
+        json.dump(oids, f, indent=1, sort_keys=True)
+    os.replace(os.path.join(opts.output, "oids.json.tmp"), os.path.join(opts.output, "oids.json"))
+
+    print(f"{len(wanted)} references, {len(oids)} objects, "
+          f"{len(set(mibs.files[name] for name in needed))} of {len(set(mibs.files.values()))} MIB files", file=sys.stderr)
+    if missing:
+        raise SystemExit(1)
@@ -0,0 +1,163 @@
+"""Keep a compact local snapshot of the Netbox devices Telegraf is rendered for
+
+Usage: python3 netbox_inventory.py [--full] <netbox url> <snapshot.json.gz>
+
+The first sync reads every device with a primary IP in wide REST pages, asking
+only for the fields the templates use, and stores them gzipped as
+{"synced": time, "devices": {id: device}}. Later syncs only ask for devices
+with last_updated since the previous sync, plus a brief list of ids to find
+deleted devices. A rename of a site, location or device type doesn't touch
+its devices' last_updated, so a change to any of those triggers a full sync,
+as does a snapshot older than FULL_SYNC_AGE. If Netbox can't be reached the
+existing snapshot is used as it is. The token is read from NETBOX_TOKEN.
+"""
+
+import os
+import sys
+import gzip
+import json
+import argparse
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PAGE_SIZE = 1000
+# fields of a device the templates use
+FIELDS = [
+    "id", "name", "serial", "description", "site", "location", "device_type",
+    "primary_ip", "custom_fields", "last_updated",
+]
+# objects whose changes aren't reflected in their devices' last_updated
+RELATED = ["dcim/sites", "dcim/locations", "dcim/device-types", "dcim/manufacturers"]
+# margin for clock differences between this host and Netbox
+SKEW = timedelta(minutes=5)
+FULL_SYNC_AGE = timedelta(days=1)
+
+
+def compact(device: dict) -> dict:
+    """Keep only what the templates use from a REST device record"""
+    def name(obj):
+        return {"name": obj["name"]} if obj else None
+
+    device_type = device.get("device_type") or {}
+    custom_fields = device.get("custom_fields") or {}
+    return {
+        "id": device["id"],
+        "name": device.get("name"),
+        "serial": device.get("serial", ""),
+        "description": device.get("description", ""),
+        "site": name(device.get("site")),
+        "location": name(device.get("location")),
+        "device_type": {
+            "model": device_type.get("model"),
+            "manufacturer": name(device_type.get("manufacturer")),
+        },
+        "primary_ip": {"address": device["primary_ip"]["address"]} if device.get("primary_ip") else None,
+        "custom_fields": {
+            key: custom_fields.get(key) for key in ("allow_alerts", "telegraf_templates")
+        },
+    }
+
+
+class Netbox:
+    def __init__(self, url: str, token: str):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Token {token}", "Accept": "application/json"})
+
+    def pages(self, endpoint: str, params: dict):
+        """Yield the results of every page of a list endpoint"""
+        url = f"{self.url}/api/{endpoint}/"
+        params = {"limit": PAGE_SIZE, **params}
+        while url:
+            resp = self.session.get(url, params=params, timeout=60)
+            resp.raise_for_status()
+            page = resp.json()
+            yield from page["results"]
+            # the next link already carries the query
+            url, params = page.get("next"), None
+
+    def devices(self, **filters) -> list:
+        return list(self.pages("dcim/devices", {"fields": ",".join(FIELDS), **filters}))
+
+    def device_ids(self) -> set:
+        return {device["id"] for device in self.pages("dcim/devices", {"brief": "true", "has_primary_ip": "true"})}
+
+    def changed(self, endpoint: str, since: str) -> bool:
+        resp = self.session.get(
+            f"{self.url}/api/{endpoint}/",
+            params={"limit": 1, "brief": "true", "last_updated__gte": since},
+            timeout=60,
+        )
+        resp.raise_for_status()
+        return resp.json()["count"] > 0
+
+
+def load(path: str):
+    try:
+        with gzip.open(path, "rt") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save(path: str, snapshot: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with gzip.open(f"{path}.tmp", "wt") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(f"{path}.tmp", path)
+
+
+def sync(netbox: Netbox, snapshot: dict = None, full: bool = False) -> dict:
+    """Return an up to date snapshot, fetching only what changed since the
+    given one unless a full sync is needed"""
+    started = datetime.now(timezone.utc)
+    if snapshot is not None and not full:
+        synced = datetime.fromisoformat(snapshot["synced"])
+        since = (synced - SKEW).isoformat()
+        if started - synced > FULL_SYNC_AGE:
+            full = True
+        else:
+            with ThreadPoolExecutor(len(RELATED)) as pool:
+                full = any(pool.map(lambda endpoint: netbox.changed(endpoint, since), RELATED))
+
+    if snapshot is None or full:
+        devices = {str(device["id"]): compact(device) for device in netbox.devices(has_primary_ip="true")}
+    else:
+        devices = dict(snapshot["devices"])
+        for device in netbox.devices(last_updated__gte=since):
+            if device.get("primary_ip"):
+                devices[str(device["id"])] = compact(device)
+            else:
+                devices.pop(str(device["id"]), None)
+        ids = {str(id) for id in netbox.device_ids()}
+        devices = {id: device for id, device in devices.items() if id in ids}
+
+    return {"synced": started.isoformat(), "devices": devices}
+
+
+def inventory(url: str, path: str, full: bool = False) -> list:
+    """Sync the snapshot at path and return its devices. If Netbox is
+    unreachable the saved snapshot is returned unchanged."""
+    snapshot = load(path)
+    try:
+        snapshot = sync(Netbox(url, os.environ["NETBOX_TOKEN"]), snapshot, full)
+    except requests.RequestException as e:
+        if snapshot is None:
+            raise
+        print(f"Netbox sync failed, using snapshot from {snapshot['synced']}: {e!r}", file=sys.stderr)
+    else:
+        save(path, snapshot)
+    return list(snapshot["devices"].values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="refetch every device")
+    parser.add_argument("netbox", help="Netbox URL")
+    parser.add_argument("snapshot", help="snapshot file, e.g. /var/cache/aragorn/netbox.json.gz")
+    opts = parser.parse_args()
+
+    devices = inventory(opts.netbox, opts.snapshot, opts.full)
+    print(f"{len(devices)} devices", file=sys.stderr)
@@ -0,0 +1,368 @@
+"""Render Telegraf configs for Netbox devices into a conf.d directory
+
+Usage: python3 render.py [--netbox URL [--snapshot FILE] | --devices FILE] [--oids FILE] [--reload CMD] <conf.d>
+
+Each device lists the templates it needs (file names in telegraf_templates,
+with or without .conf) in its `telegraf_templates` custom field. The templates
+are compiled once per worker process and devices are rendered in parallel.
+Every device gets one file, netbox_<id>.conf, which is only rewritten when the
+sha256 of its content changed, and files of devices which are gone are
+removed. The reload command, e.g. "systemctl reload telegraf", only runs when
+something was written or removed.
+
+Templates made only of [[inputs.snmp]] blocks are instead rendered once for
+all their devices, into netbox_snmp_<template>.conf, with every device in the
+agents list. The per-device tags which set them apart are written to
+netbox_snmp_tags.json, keyed by source, and added back by the processors.lookup
+in netbox_snmp_lookup.conf. --no-group renders them per device like other templates.
+
+--oids takes the oids.json written by mibc.py and replaces the symbolic OIDs
+of SNMP fields with numeric ones, so Telegraf needn't translate them. Fields
+with enum conversion and table OIDs, whose columns come from the MIB, are
+left as they are.
+
+--netbox syncs the local inventory snapshot from Netbox (see
+netbox_inventory.py) and renders from it; --devices reads a JSON list of
+device records in the same format.
+"""
+
+import os
+import sys
+import json
+import re
+import hashlib
+import argparse
+import ipaddress
+import subprocess
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+
+from jinja2 import Environment, FileSystemLoader
+
+from netbox_inventory import inventory
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "telegraf_templates")
+# templates include the common tags by their Netbox config template id
+INCLUDES = {"100": "common_tags.jinja"}
+TEMPLATE_FIELD = "telegraf_templates"
+PREFIX = "netbox_"
+# per-device tags of grouped SNMP inputs, keyed by source, and the
+# processors.lookup which adds them
+TAGS_FILE = f"{PREFIX}snmp_tags.json"
+LOOKUP_FILE = f"{PREFIX}snmp_lookup.conf"
+SYMBOLIC_OID = re.compile(r"""^(\s*oid\s*=\s*)(['"])([\w-]+::([\w-]+))((?:\.\d+)*)\2\s*$""")
+
+_environment = None
+_oids = {}
+
+
+class TemplateLoader(FileSystemLoader):
+    """Load templates by file name, or by Netbox id for shared includes"""
+
+    def get_source(self, environment, template):
+        return super().get_source(environment, INCLUDES.get(template, template))
+
+
+def init_worker(template_dir: str, oids: dict = None):
+    global _environment, _oids
+    _environment = Environment(loader=TemplateLoader(template_dir), keep_trailing_newline=True)
+    _oids = oids or {}
+
+
+def load_oids(path: str) -> dict:
+    """MODULE::name to numeric OID, from mibc.py's oids.json"""
+    with open(path) as f:
+        return {name: node["oid"] for name, node in json.load(f).items()}
+
+
+def numeric_oids(content: str, oids: dict) -> str:
+    """Replace the symbolic OIDs of SNMP fields with numeric ones. A field
+    without a name gets the object's name, which Telegraf would otherwise
+    look up."""
+    sections = [[]]
+    for line in content.splitlines(keepends=True):
+        if line.lstrip().startswith("["):
+            sections.append([])
+        sections[-1].append(line)
+
+    for section in sections:
+        if not section or section[0].strip() not in ("[[inputs.snmp.field]]", "[[inputs.snmp.table.field]]"):
+            continue
+        if any(re.match(r"""\s*conversion\s*=\s*['"]enum""", line) for line in section):
+            continue
+        for i, line in enumerate(section):
+            match = SYMBOLIC_OID.match(line)
+            if match and match.group(3) in oids:
+                prefix, quote, name, symbol, index = match.groups()
+                section[i] = f"{prefix}{quote}{oids[name]}{index}{quote}\n"
+                if not any(re.match(r"\s*name\s*=", other) for other in section):
+                    indent = prefix[:len(prefix) - len(prefix.lstrip())]
+                    section.insert(i + 1, f"{indent}name = {quote}{symbol}{index}{quote}\n")
+                break
+    return "".join(line for section in sections for line in section)
+
+
+def template_names(device: dict) -> list:
+    """Template file names from the device's custom field, a list or a
+    comma separated string"""
+    names = (device.get("custom_fields") or {}).get(TEMPLATE_FIELD) or []
+    if isinstance(names, str):
+        names = names.split(",")
+    return [name if name.endswith(".conf") else f"{name}.conf" for name in map(str.strip, names) if name]
+
+
+def prepare(device: dict) -> dict:
+    """Shape a REST device record like the Netbox model the templates were
+    written for: custom_field_data, and primary_ip.address with an .ip"""
+    device = dict(device)
+    device["custom_field_data"] = device.get("custom_fields") or {}
+    primary_ip = device.get("primary_ip")
+    if primary_ip and primary_ip.get("address"):
+        device["primary_ip"] = {**primary_ip, "address": ipaddress.ip_interface(primary_ip["address"])}
+    return device
+
+
+def with_offset(content: str, offset: float) -> str:
+    """Add collection_offset to every input plugin block"""
+    return re.sub(
+        r"^(\[\[inputs\.\w+\]\]\n)", f'\\1  collection_offset = "{offset}s"\n', content, flags=re.MULTILINE
+    )
+
+
+def render_device(device: dict, names: list, offset: float = None) -> str:
+    context = {"device": prepare(device)}
+    content = "\n".join(_environment.get_template(name).render(context) for name in names)
+    if _oids:
+        content = numeric_oids(content, _oids)
+    return content if offset is None else with_offset(content, offset)
+
+
+def render_batch(jobs: list) -> list:
+    """Render (device, template names, offset) jobs, returning (file name,
+    content, error) for each"""
+    results = []
+    for device, names, offset in jobs:
+        name = f"{PREFIX}{device['id']}.conf"
+        try:
+            results.append((name, render_device(device, names, offset), None))
+        except Exception as e:
+            results.append((name, None, f"{e!r}"))
+    return results
+
+
+def groupable(template_dir: str, name: str) -> bool:
+    """Whether a template only holds SNMP inputs, which can share one block"""
+    try:
+        with open(os.path.join(template_dir, name)) as f:
+            source = f.read()
+    except FileNotFoundError:
+        return False
+    inputs = re.findall(r"^\[\[inputs\.([\w.]+)\]\]", source, re.MULTILINE)
+    return bool(inputs) and all(plugin == "snmp" for plugin in inputs)
+
+
+def group_config(content: str, alias: str, agents: list) -> str:
+    """Turn one device's rendered SNMP template into a block for all agents:
+    set the inputs' alias and agents, and drop their [inputs.snmp.tags]"""
+    agent_list = ", ".join(f'"{agent}"' for agent in agents)
+    lines = []
+    section = ""
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("["):
+            section = stripped
+        if section == "[inputs.snmp.tags]":
+            if stripped:
+                continue
+            section = ""
+        elif section.startswith("[[inputs.snmp"):
+            if stripped.startswith("agents = "):
+                line = f"  agents = [{agent_list}]"
+            elif stripped.startswith("alias = "):
+                line = f'  alias = "{alias}"'
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def lookup_config(path: str) -> str:
+    return (
+        "[[processors.lookup]]\n"
+        "  # per-device tags of the grouped SNMP inputs\n"
+        f'  files = ["{path}"]\n'
+        '  fileformat = "json"\n'
+        "  key = '{{.Tag \"source\"}}'\n"
+    )
+
+
+def device_tags(device: dict) -> dict:
+    """The common tags of one device, parsed from the rendered include"""
+    return tomllib.loads(_environment.get_template("100").render({"device": prepare(device)}))
+
+
+def render_group(name: str, devices: list, offset: float = None) -> tuple:
+    """Render one SNMP template for a group of devices. Returns (file name,
+    content, {source: tags}, errors)."""
+    base = name.removesuffix(".conf")
+    file_name = f"{PREFIX}snmp_{base}.conf"
+    agents, tags, errors = [], {}, []
+    for device in devices:
+        try:
+            source = str(prepare(device)["primary_ip"]["address"].ip)
+            tags[source] = device_tags(device)
+            if not agents:
+                first = device
+            agents.append(source)
+        except Exception as e:
+            errors.append((f"{PREFIX}{device['id']}.conf", f"{e!r}"))
+    if not agents:
+        return file_name, None, tags, errors
+
+    try:
+        content = group_config(render_device(first, [name], offset), f"snmp_{base}", agents)
+        tomllib.loads(content)
+    except Exception as e:
+        return file_name, None, tags, errors + [(file_name, f"{e!r}")]
+    return file_name, content, tags, errors
+
+
+def previous_tags(conf_dir: str, name: str) -> dict:
+    """{source: tags} of the agents in an existing grouped file, from the
+    existing tags file, so a group which fails to render keeps polling its
+    devices with their last tags"""
+    try:
+        with open(os.path.join(conf_dir, name), "rb") as f:
+            config = tomllib.load(f)
+        with open(os.path.join(conf_dir, TAGS_FILE)) as f:
+            old_tags = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    agents = {agent for snmp in config.get("inputs", {}).get("snmp", []) for agent in snmp.get("agents", [])}
+    return {source: source_tags for source, source_tags in old_tags.items() if source in agents}
+
+
+def digest(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def file_digest(path: str):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_atomic(path: str, content: str):
+    with open(f"{path}.tmp", "w") as f:
+        f.write(content)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_changed(conf_dir: str, name: str, content: str) -> bool:
+    """Write a file unless it already has this content"""
+    path = os.path.join(conf_dir, name)
+    if file_digest(path) == digest(content):
+        return False
+    write_atomic(path, content)
+    return True
+
+
+def render(
+    devices: list, conf_dir: str, workers: int = None, group: bool = True, offsets: dict = None, oids: dict = None
+) -> tuple:
+    """Render devices into conf_dir. Returns (written, removed, failed) counts.
+    offsets optionally maps device id, or the name of a grouped SNMP
+    template, to a collection_offset in seconds; a grouped input without one
+    takes the offset of its first device. oids maps
+    MODULE::name to the numeric OIDs to write instead."""
+    offsets = offsets or {}
+    grouped = {}
+    jobs = []
+    for device in devices:
+        names = []
+        for name in template_names(device):
+            if group and device.get("primary_ip") and groupable(TEMPLATE_DIR, name):
+                grouped.setdefault(name, []).append(device)
+            else:
+                names.append(name)
+        if names:
+            jobs.append((device, names, offsets.get(device["id"])))
+
+    workers = workers or os.cpu_count() or 1
+    size = max(len(jobs) // (workers * 4), 1)
+    batches = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+    written = failed = 0
+    wanted = set()
+    tags = {}
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(TEMPLATE_DIR, oids)) as pool:
+        groups = [
+            pool.submit(render_group, name, members, offsets.get(name, offsets.get(members[0]["id"])))
+            for name, members in sorted(grouped.items())
+        ]
+        for results in pool.map(render_batch, batches):
+            for name, content, error in results:
+                wanted.add(name)
+                if error is not None:
+                    failed += 1
+                    print(f"{name}: {error}", file=sys.stderr)
+                elif write_changed(conf_dir, name, content):
+                    written += 1
+
+        for future in groups:
+            name, content, group_tags, errors = future.result()
+            wanted.add(name)
+            for device_name, error in errors:
+                failed += 1
+                print(f"{device_name}: {error}", file=sys.stderr)
+            if content is None or errors:
+                # like a device whose render fails, the group keeps its
+                # previous file rather than losing devices from agents
+                print(f"{name}: kept the previous file", file=sys.stderr)
+                tags.update(previous_tags(conf_dir, name))
+            else:
+                tags.update(group_tags)
+                written += write_changed(conf_dir, name, content)
+
+    if tags or grouped:
+        wanted.update([TAGS_FILE, LOOKUP_FILE])
+        written += write_changed(conf_dir, TAGS_FILE, json.dumps(tags, indent=1, sort_keys=True) + "\n")
+        written += write_changed(conf_dir, LOOKUP_FILE, lookup_config(os.path.join(os.path.abspath(conf_dir), TAGS_FILE)))
+
+    removed = 0
+    for name in os.listdir(conf_dir):
+        if name.startswith(PREFIX) and name.endswith((".conf", ".json")) and name not in wanted:
+            os.remove(os.path.join(conf_dir, name))
+            removed += 1
+
+    return written, removed, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--netbox", help="Netbox URL, with the token in NETBOX_TOKEN")
+    parser.add_argument("--snapshot", default="/var/cache/aragorn/netbox.json.gz", help="inventory snapshot file")
+    source.add_argument("--devices", help="JSON file with a list of device records")
+    parser.add_argument("--reload", help="command to run when any file changed")
+    parser.add_argument("--workers", type=int, help="render processes, default one per CPU")
+    parser.add_argument("--no-group", action="store_true", help="render SNMP templates per device too")
+    parser.add_argument("--oids", help="oids.json from mibc.py, to write numeric OIDs")
+    parser.add_argument("conf_dir", help="directory for the rendered files, e.g. /etc/telegraf/telegraf.d")
+    opts = parser.parse_args()
+
+    if opts.netbox:
+        devices = inventory(opts.netbox, opts.snapshot)
+    else:
+        with open(opts.devices) as f:
+            devices = json.load(f)
+
+    os.makedirs(opts.conf_dir, exist_ok=True)
+    oids = load_oids(opts.oids) if opts.oids else None
+    written, removed, failed = render(devices, opts.conf_dir, opts.workers, not opts.no_group, oids=oids)
+    print(f"{written} written, {removed} removed, {failed} failed", file=sys.stderr)
+
+    if (written or removed) and opts.reload:
+        subprocess.run(opts.reload, shell=True, check=True)
+    if failed:
+        raise SystemExit(1)
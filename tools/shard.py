@@ -0,0 +1,189 @@
+"""Split rendered devices across several Telegraf instances with balanced load
+
+Usage: python3 shard.py [--netbox URL [--snapshot FILE] | --devices FILE]
+                        [--shards N] [--interval S] [--oids FILE] [--reload CMD] <conf root>
+
+Each template gets a cost per poll from what it asks Telegraf to do: an exec
+spawns a Python process, an execd collector only wakes a resident one, and an
+SNMP input costs per field plus per table walk, where a walk takes one GETBULK
+per max_repetitions rows (barco_projector walks one row per request). Devices
+are assigned to the least loaded of N shards, most expensive first, and each
+shard is rendered with render.py into <conf root>/<n>/ for its own Telegraf
+(--config-directory). Within a shard every input gets a collection_offset so
+that polls are spread over the interval in proportion to their cost instead
+of all firing at once.
+
+SNMP templates which render.py groups into one input for all their devices
+are costed and staggered as that one input: its plugin cost once and its
+fields and walks once per agent, at a single offset sized by the agent count.
+"""
+
+import os
+import re
+import sys
+import json
+import heapq
+import argparse
+import subprocess
+
+import render
+from netbox_inventory import inventory
+
+# cost of one poll of an input plugin, before fields and tables
+PLUGIN_COSTS = {
+    "exec": 30.0,
+    "execd": 3.0,
+    "snmp": 1.0,
+    "http": 2.0,
+    "prometheus": 3.0,
+    "ping": 1.0,
+    "net_response": 0.5,
+}
+DEFAULT_PLUGIN_COST = 2.0
+SNMP_FIELD_COST = 0.2
+# per GETBULK request of a table walk
+SNMP_REQUEST_COST = 0.5
+# rows assumed in a table and columns in a table walked without fields
+TABLE_ROWS = 16
+TABLE_COLUMNS = 8
+# Telegraf's default max_repetitions
+MAX_REPETITIONS = 10
+
+
+def template_cost(source: str) -> tuple:
+    """Estimated cost of one poll of everything a template defines, as (the
+    inputs' plugin cost, the cost of the fields and walks of one agent)"""
+    base = per_agent = 0.0
+    inputs = []  # [plugin, max_repetitions, fields, [columns per table]]
+    for line in source.splitlines():
+        line = line.split("#")[0].strip()
+        header = re.match(r"^\[\[inputs\.([\w.]+)\]\]$", line)
+        if header:
+            section = header.group(1)
+            if "." not in section:
+                inputs.append([section, MAX_REPETITIONS, 0, []])
+            elif section == "snmp.field":
+                inputs[-1][2] += 1
+            elif section == "snmp.table":
+                inputs[-1][3].append(0)
+            elif section == "snmp.table.field":
+                inputs[-1][3][-1] += 1
+        elif inputs and line.startswith("max_repetitions"):
+            inputs[-1][1] = max(int(line.split("=")[1]), 1)
+
+    for plugin, max_repetitions, fields, tables in inputs:
+        base += PLUGIN_COSTS.get(plugin, DEFAULT_PLUGIN_COST)
+        per_agent += fields * SNMP_FIELD_COST
+        for columns in tables:
+            columns = columns or TABLE_COLUMNS
+            requests = -(-TABLE_ROWS * columns // max_repetitions)
+            per_agent += columns * TABLE_ROWS * SNMP_FIELD_COST + requests * SNMP_REQUEST_COST
+    return base, per_agent
+
+
+def template_costs(template_dir: str = render.TEMPLATE_DIR) -> dict:
+    costs = {}
+    for name in os.listdir(template_dir):
+        if name.endswith(".conf"):
+            with open(os.path.join(template_dir, name)) as f:
+                costs[name] = template_cost(f.read())
+    return costs
+
+
+def grouped_templates(template_dir: str = render.TEMPLATE_DIR) -> set:
+    """Templates render.py renders as one input for all their devices"""
+    return {name for name in os.listdir(template_dir) if name.endswith(".conf") and render.groupable(template_dir, name)}
+
+
+def device_templates(device: dict, grouped: set) -> list:
+    """(template, whether it is in a grouped input) for each of a device's templates"""
+    in_group = bool(device.get("primary_ip"))
+    return [(name, in_group and name in grouped) for name in render.template_names(device)]
+
+
+def device_cost(device: dict, costs: dict, grouped: set = frozenset()) -> float:
+    """A device's share of the shard's load: all of its own inputs, and only
+    its agent's fields and walks of a grouped input"""
+    cost = 0.0
+    for name, in_group in device_templates(device, grouped):
+        base, per_agent = costs.get(name, (DEFAULT_PLUGIN_COST, 0.0))
+        cost += per_agent if in_group else base + per_agent
+    return cost
+
+
+def partition(devices: list, shards: int, costs: dict, grouped: set = frozenset()) -> list:
+    """Longest processing time first: each device, most expensive first, goes
+    to the shard with the lowest total so far. Returns (load, devices) per shard."""
+    heap = [(0.0, n) for n in range(shards)]
+    members = [[] for _ in range(shards)]
+    loads = [0.0] * shards
+    for cost, device in sorted(((device_cost(d, costs, grouped), d) for d in devices), key=lambda item: -item[0]):
+        load, n = heapq.heappop(heap)
+        members[n].append(device)
+        loads[n] = load + cost
+        heapq.heappush(heap, (loads[n], n))
+    return list(zip(loads, members))
+
+
+def stagger(devices: list, costs: dict, interval: float, grouped: set = frozenset()) -> dict:
+    """collection_offset per device id, for the device's own inputs, and per
+    grouped template name, placing each at the share of the interval taken by
+    the inputs before it. A grouped input is one poll of all its agents, so
+    it is one unit costing its plugin once and its fields per agent."""
+    units = {}
+    for device in devices:
+        own = 0.0
+        for name, in_group in device_templates(device, grouped):
+            base, per_agent = costs.get(name, (DEFAULT_PLUGIN_COST, 0.0))
+            if in_group:
+                units[name] = units.get(name, base) + per_agent
+            else:
+                own += base + per_agent
+        if own:
+            units[device["id"]] = own
+    total = sum(units.values()) or 1
+    offsets = {}
+    before = 0.0
+    for key, cost in units.items():
+        offsets[key] = round(interval * before / total, 2)
+        before += cost
+    return offsets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--netbox", help="Netbox URL, with the token in NETBOX_TOKEN")
+    source.add_argument("--devices", help="JSON file with a list of device records")
+    parser.add_argument("--snapshot", default="/var/cache/aragorn/netbox.json.gz", help="inventory snapshot file")
+    parser.add_argument("--shards", type=int, default=os.cpu_count(), help="Telegraf instances, default one per CPU")
+    parser.add_argument("--interval", type=float, default=10, help="Telegraf collection interval in seconds")
+    parser.add_argument("--reload", help='command to run when a shard changed, {} is replaced by the shard number, e.g. "systemctl reload telegraf@{}"')
+    parser.add_argument("--oids", help="oids.json from mibc.py, to write numeric OIDs")
+    parser.add_argument("conf_root", help="directory for one conf.d per shard")
+    opts = parser.parse_args()
+
+    if opts.netbox:
+        devices = inventory(opts.netbox, opts.snapshot)
+    else:
+        with open(opts.devices) as f:
+            devices = json.load(f)
+    devices = [device for device in devices if render.template_names(device)]
+
+    costs = template_costs()
+    grouped = grouped_templates()
+    oids = render.load_oids(opts.oids) if opts.oids else None
+    failed = 0
+    for n, (load, members) in enumerate(partition(devices, opts.shards, costs, grouped)):
+        conf_dir = os.path.join(opts.conf_root, str(n))
+        os.makedirs(conf_dir, exist_ok=True)
+        written, removed, shard_failed = render.render(
+            members, conf_dir, offsets=stagger(members, costs, opts.interval, grouped), oids=oids
+        )
+        failed += shard_failed
+        print(f"shard {n}: {len(members)} devices, cost {load:.0f}, "
+              f"{written} written, {removed} removed, {shard_failed} failed", file=sys.stderr)
+        if (written or removed) and opts.reload:
+            subprocess.run(opts.reload.replace("{}", str(n)), shell=True, check=True)
+    if failed:
+        raise SystemExit(1)
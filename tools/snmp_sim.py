@@ -0,0 +1,228 @@
+"""A local SNMPv2c agent serving a recorded walk, for tuning and testing
+
+Usage: python3 snmp_sim.py [--port N] [--latency S] [--bulk-limit N] <walk file>
+
+The walk file is `snmpwalk -On` output, or what `snmp_tune.py record` writes.
+Header comments set how the agent behaves, so a recording can carry the
+quirks of its device; the command line overrides them:
+
+    # latency = 0.02       seconds before each response
+    # per_varbind = 0.0005 seconds per varbind in a response
+    # max_size = 1472      largest response; GETBULK responses are cut short
+    # bulk_limit = 1       above this many repetitions the agent returns
+                           broken names, as some projectors do
+
+GET, GETNEXT and GETBULK are answered; SETs are refused.
+"""
+
+import os
+import re
+import sys
+import time
+import bisect
+import argparse
+import ipaddress
+import threading
+import socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exec_scripts"))
+
+import snmp_pdu as pdu
+
+OPTIONS = {"latency": 0.0, "per_varbind": 0.0, "max_size": 1472, "bulk_limit": 0}
+TYPES = {
+    "INTEGER": pdu.INTEGER,
+    "STRING": pdu.OCTET_STRING,
+    "Hex-STRING": pdu.OCTET_STRING,
+    "BITS": pdu.OCTET_STRING,
+    "OID": pdu.OBJECT_IDENTIFIER,
+    "IpAddress": pdu.IP_ADDRESS,
+    "Counter32": pdu.COUNTER32,
+    "Gauge32": pdu.GAUGE32,
+    "Timeticks": pdu.TIMETICKS,
+    "Counter64": pdu.COUNTER64,
+    "Opaque": pdu.OPAQUE,
+}
+NAMES = {
+    pdu.INTEGER: "INTEGER",
+    pdu.OBJECT_IDENTIFIER: "OID",
+    pdu.IP_ADDRESS: "IpAddress",
+    pdu.COUNTER32: "Counter32",
+    pdu.GAUGE32: "Gauge32",
+    pdu.TIMETICKS: "Timeticks",
+    pdu.COUNTER64: "Counter64",
+}
+LINE = re.compile(r"^(\.?[\d.]+) = (?:([\w-]+): ?)?(.*)$")
+
+
+def parse_value(kind: str, text: str) -> tuple:
+    tag = TYPES.get(kind, pdu.OCTET_STRING)
+    if kind in ("Hex-STRING", "BITS", "Opaque"):
+        return tag, bytes.fromhex("".join(re.findall(r"\b[0-9A-Fa-f]{2}\b", text.split("  ")[0])))
+    if kind == "STRING" or kind is None:
+        if text.startswith('"') and text.endswith('"'):
+            text = text[1:-1].replace('\\"', '"')
+        return tag, text.encode()
+    if kind == "OID":
+        return tag, pdu.parse_oid(text)
+    if kind == "IpAddress":
+        return tag, ipaddress.IPv4Address(text).packed
+    # INTEGER: on(1), Timeticks: (12345) 0:02:03.45, Gauge32: 5 C
+    number = re.search(r"\((-?\d+)\)", text)
+    return tag, int(number.group(1) if number else re.search(r"-?\d+", text).group(0))
+
+
+def load(path: str) -> tuple:
+    """(options, sorted [(oid, value)]) from a walk file"""
+    options = dict(OPTIONS)
+    entries = {}
+    with open(path, errors="replace") as f:
+        last = None
+        for line in f:
+            line = line.rstrip("\r\n")
+            setting = re.match(r"^#\s*(\w+)\s*=\s*([\d.]+)", line)
+            if setting and setting.group(1) in options:
+                options[setting.group(1)] = type(OPTIONS[setting.group(1)])(setting.group(2))
+                continue
+            match = LINE.match(line)
+            if match and not match.group(3).startswith(("No Such", "No more")):
+                oid = pdu.parse_oid(match.group(1))
+                entries[oid] = parse_value(match.group(2), match.group(3))
+                last = oid if match.group(2) == "STRING" and not match.group(3).endswith('"') else None
+            elif last is not None:
+                # continuation of a multi-line string
+                tag, value = entries[last]
+                entries[last] = (tag, value + b"\n" + line.rstrip('"').encode())
+    return options, sorted(entries.items())
+
+
+def format_value(tag: int, value) -> str:
+    if tag == pdu.OBJECT_IDENTIFIER:
+        return f"OID: {pdu.format_oid(value)}"
+    if tag == pdu.IP_ADDRESS:
+        return f"IpAddress: {ipaddress.IPv4Address(value)}"
+    if tag == pdu.TIMETICKS:
+        return f"Timeticks: ({value})"
+    if tag in NAMES:
+        return f"{NAMES[tag]}: {value}"
+    try:
+        text = value.decode()
+        if text.isprintable():
+            return 'STRING: "' + text.replace('"', '\\"') + '"'
+    except UnicodeDecodeError:
+        pass
+    return "Hex-STRING: " + " ".join(f"{byte:02X}" for byte in value)
+
+
+def dump(path: str, entries: list, options: dict = None):
+    with open(f"{path}.tmp", "w") as f:
+        for name, value in (options or {}).items():
+            f.write(f"# {name} = {value}\n")
+        for oid, value in entries:
+            f.write(f"{pdu.format_oid(oid)} = {format_value(*value)}\n")
+    os.replace(f"{path}.tmp", path)
+
+
+class Agent:
+    """Answers requests from a sorted walk, with community, or any if it is None"""
+
+    def __init__(self, entries: list, community: bytes = b"public", **options):
+        self.oids = [oid for oid, _ in entries]
+        self.values = [value for _, value in entries]
+        self.community = community
+        self.options = {**OPTIONS, **options}
+        self.requests = 0
+
+    def get(self, oid: tuple) -> tuple:
+        i = bisect.bisect_left(self.oids, oid)
+        if i < len(self.oids) and self.oids[i] == oid:
+            return oid, self.values[i]
+        return oid, (pdu.NO_SUCH_INSTANCE, None)
+
+    def get_next(self, oid: tuple) -> tuple:
+        i = bisect.bisect_right(self.oids, oid)
+        if i < len(self.oids):
+            return self.oids[i], self.values[i]
+        return oid, (pdu.END_OF_MIB_VIEW, None)
+
+    def respond(self, request: pdu.Message):
+        """The response message for a request, or None to drop it"""
+        self.requests += 1
+        if self.community is not None and request.community != self.community:
+            return None
+        oids = [oid for oid, _ in request.varbinds]
+        error_status = error_index = 0
+        if request.pdu == pdu.GET:
+            varbinds = [self.get(oid) for oid in oids]
+        elif request.pdu == pdu.GET_NEXT:
+            varbinds = [self.get_next(oid) for oid in oids]
+        elif request.pdu == pdu.GET_BULK:
+            varbinds = self.get_bulk(oids, request.error_status, request.error_index)
+        else:
+            varbinds = [(oid, (pdu.NULL, None)) for oid in oids]
+            error_status, error_index = 17, 1  # notWritable
+        response = pdu.Message(
+            request.version, request.community, pdu.RESPONSE, request.request_id, error_status, error_index, varbinds
+        )
+        while len(pdu.encode(response)) > self.options["max_size"]:
+            if request.pdu != pdu.GET_BULK or len(response.varbinds) <= 1:
+                response = response._replace(error_status=pdu.TOO_BIG, error_index=0, varbinds=[
+                    (oid, (pdu.NULL, None)) for oid in oids
+                ])
+                break
+            response = response._replace(varbinds=response.varbinds[:len(response.varbinds) * 3 // 4])
+        time.sleep(self.options["latency"] + self.options["per_varbind"] * len(response.varbinds))
+        return response
+
+    def get_bulk(self, oids: list, non_repeaters: int, max_repetitions: int) -> list:
+        varbinds = [self.get_next(oid) for oid in oids[:non_repeaters]]
+        repeating = oids[non_repeaters:]
+        limit = self.options["bulk_limit"]
+        for repetition in range(max(max_repetitions, 0)):
+            row = [self.get_next(oid) for oid in repeating]
+            repeating = [oid for oid, _ in row]
+            if limit and max_repetitions > limit and repetition:
+                # the names of later repetitions come back wrong
+                row = [(varbinds[non_repeaters + i][0], value) for i, (_, value) in enumerate(row)]
+            varbinds.extend(row)
+            if all(value[0] == pdu.END_OF_MIB_VIEW for _, value in row):
+                break
+        return varbinds
+
+
+def serve(agent: Agent, port: int = 0, host: str = "127.0.0.1") -> socketserver.ThreadingUDPServer:
+    """Start answering on UDP in a thread; the address is server.server_address"""
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            try:
+                response = agent.respond(pdu.decode(data))
+            except (ValueError, IndexError):
+                return
+            if response is not None:
+                sock.sendto(pdu.encode(response), self.client_address)
+
+    server = socketserver.ThreadingUDPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=1161)
+    parser.add_argument("--community", default="public")
+    for name, default in OPTIONS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), dest=name)
+    parser.add_argument("walk", help="snmpwalk -On output")
+    opts = parser.parse_args()
+
+    options, entries = load(opts.walk)
+    options.update({name: getattr(opts, name) for name in OPTIONS if getattr(opts, name) is not None})
+    server = serve(Agent(entries, opts.community.encode(), **options), opts.port, "0.0.0.0")
+    print(f"serving {len(entries)} OIDs on udp/{opts.port}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,313 @@
+"""Measure the fastest correct SNMP bulk settings for a template
+
+Usage: python3 snmp_tune.py record [--community C] [--port N] <host> <walk file>
+       python3 snmp_tune.py tune (--walk FILE | --agent HOST[:PORT]) [--write] <template>
+
+record walks a device with GETNEXT, which every agent gets right, and saves
+it with its measured latency for snmp_sim.py. tune runs against a recording,
+served by snmp_sim.py in process, or a live agent. For each [[inputs.snmp]]
+of the template it resolves the fields and tables through the MIBs and, with
+the input's version and community:
+
+- walks every table with GETNEXT as the reference, then with GETBULK at each
+  of MAX_REPETITIONS, timing each and checking names and values against the
+  reference, so agents that break above some size are caught;
+- times the fields as Telegraf gets them, batched into GETs of up to
+  MAX_GET_OIDS, and checks the values against one GET per field, so agents
+  which mishandle multi-OID GETs are caught;
+- picks the fastest correct max_repetitions and a timeout of TIMEOUT_FACTOR
+  times the slowest response seen.
+
+SNMPv1 has no GETBULK, so v1 inputs get only a timeout, measured walking
+their tables with GETNEXT as Telegraf does. v3 inputs are skipped.
+
+--write puts max_repetitions and timeout into the template's inputs.
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import random
+import socket
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exec_scripts"))
+
+import snmp_pdu as pdu
+import snmp_sim
+import mibc
+
+MAX_REPETITIONS = [1, 2, 5, 10, 20, 40, 60]
+TIMEOUT_FACTOR = 4
+MIN_TIMEOUT = 1.0
+# varbinds per GET, as Telegraf batches scalar fields (gosnmp's MaxOids)
+MAX_GET_OIDS = 60
+OID_LINE = re.compile(r"""^\s*oid\s*=\s*(['"])(.+?)\1""")
+VERSION_LINE = re.compile(r"^\s*version\s*=\s*(\d)")
+COMMUNITY_LINE = re.compile(r"""^\s*community\s*=\s*(['"])(.*?)\1""")
+
+
+class BrokenAgent(Exception):
+    pass
+
+
+class Client:
+    def __init__(
+        self, host: str, port: int = 161, community: str = "public", timeout: float = 2, retries: int = 1,
+        version: int = pdu.VERSION_2C,
+    ):
+        self.address = (socket.gethostbyname(host), port)
+        self.community = community.encode()
+        self.version = version
+        self.timeout = timeout
+        self.retries = retries
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.requests = 0
+        self.slowest = 0.0
+
+    def request(self, pdu_type: int, oids: list, error_status: int = 0, error_index: int = 0) -> pdu.Message:
+        request_id = random.randrange(1, 2**31)
+        data = pdu.encode(pdu.Message(
+            self.version, self.community, pdu_type, request_id, error_status, error_index,
+            [(oid, (pdu.NULL, None)) for oid in oids],
+        ))
+        for _ in range(self.retries + 1):
+            self.requests += 1
+            start = time.perf_counter()
+            self.sock.sendto(data, self.address)
+            deadline = start + self.timeout
+            while (remaining := deadline - time.perf_counter()) > 0:
+                self.sock.settimeout(remaining)
+                try:
+                    response = pdu.decode(self.sock.recv(65535))
+                except socket.timeout:
+                    break
+                except (ValueError, IndexError):
+                    continue
+                if response.request_id == request_id:
+                    self.slowest = max(self.slowest, time.perf_counter() - start)
+                    if response.error_status:
+                        raise BrokenAgent(f"error status {response.error_status}")
+                    return response
+        raise BrokenAgent("no response")
+
+    def get(self, oids: list) -> list:
+        return self.request(pdu.GET, oids).varbinds
+
+    def walk(self, root: tuple, max_repetitions: int = 0) -> list:
+        """Every (oid, value) under root, with GETBULK of max_repetitions, or
+        GETNEXT if 0. Raises BrokenAgent on names out of order."""
+        results = []
+        last = root
+        while True:
+            if max_repetitions:
+                varbinds = self.request(pdu.GET_BULK, [last], 0, max_repetitions).varbinds
+            else:
+                varbinds = self.request(pdu.GET_NEXT, [last]).varbinds
+            if not varbinds:
+                raise BrokenAgent("empty response")
+            for oid, value in varbinds:
+                if value[0] == pdu.END_OF_MIB_VIEW or oid[:len(root)] != root:
+                    return results
+                if oid <= last:
+                    raise BrokenAgent(f"OID not increasing after {pdu.format_oid(last)}")
+                results.append((oid, value))
+                last = oid
+
+
+def record(client: Client, path: str, root: tuple = (1, 3, 6, 1)):
+    start = time.perf_counter()
+    entries = client.walk(root)
+    options = {"latency": round((time.perf_counter() - start) / client.requests, 4)}
+    snmp_sim.dump(path, entries, options)
+    return entries
+
+
+def template_inputs(source: str, mibs: mibc.Mibs) -> list:
+    """The fields and table walk roots of each [[inputs.snmp]] as
+    {"version", "community", "fields": [oid], "tables": [oid]}, with
+    Telegraf's defaults for a missing version or community"""
+    def resolve(text):
+        if "::" not in text:
+            return pdu.parse_oid(text)
+        module, name = text.split("::")
+        name, *index = name.split(".")
+        return tuple(mibs.oid(module, name)) + tuple(map(int, index))
+
+    inputs = []
+    section = None
+    for line in source.splitlines():
+        stripped = line.split("#")[0].strip()
+        if stripped.startswith("["):
+            section = stripped
+            if section == "[[inputs.snmp]]":
+                inputs.append({"version": 2, "community": "public", "fields": [], "tables": []})
+            elif section == "[[inputs.snmp.table]]" and inputs:
+                inputs[-1]["tables"].append({"oid": None, "fields": []})
+            continue
+        if section == "[[inputs.snmp]]" and inputs:
+            if match := VERSION_LINE.match(line):
+                inputs[-1]["version"] = int(match.group(1))
+            elif match := COMMUNITY_LINE.match(line):
+                inputs[-1]["community"] = match.group(2)
+        match = OID_LINE.match(line)
+        if not match or not inputs:
+            continue
+        oid = resolve(match.group(2))
+        if section == "[[inputs.snmp.field]]":
+            inputs[-1]["fields"].append(oid)
+        elif section == "[[inputs.snmp.table]]":
+            inputs[-1]["tables"][-1]["oid"] = oid
+        elif section == "[[inputs.snmp.table.field]]":
+            inputs[-1]["tables"][-1]["fields"].append(oid)
+    for snmp_input in inputs:
+        # a table with an oid is walked whole, otherwise column by column
+        snmp_input["tables"] = [
+            root for table in snmp_input["tables"] for root in ([table["oid"]] if table["oid"] else table["fields"])
+        ]
+    return inputs
+
+
+def timed(client: Client, func, rounds: int) -> tuple:
+    """(best seconds, requests per round, result) of running func rounds times"""
+    times = []
+    for _ in range(rounds):
+        before = client.requests
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), client.requests - before, result
+
+
+def get_fields(client: Client, fields: list, group: int) -> list:
+    return [varbind for i in range(0, len(fields), group) for varbind in client.get(fields[i:i + group])]
+
+
+def tune(client: Client, snmp_input: dict, rounds: int = 3) -> dict:
+    """Measure one input. Returns {"max_repetitions", "timeout", "report"}."""
+    report = []
+    client.slowest = 0.0
+    fields, tables = snmp_input["fields"], snmp_input["tables"]
+    if fields:
+        reference = get_fields(client, fields, 1)
+        try:
+            seconds, requests, values = timed(client, lambda: get_fields(client, fields, MAX_GET_OIDS), rounds)
+            if values != reference:
+                raise BrokenAgent("values differ from single GETs")
+            report.append(f"fields: {len(fields)} in {requests} GETs {seconds:.3f} s")
+        except BrokenAgent as e:
+            report.append(f"fields: {len(fields)}, batched GET broken: {e}")
+
+    best = None
+    if tables and client.version == pdu.VERSION_1:
+        seconds, requests, _ = timed(client, lambda: [client.walk(root) for root in tables], rounds)
+        report.append(f"tables: SNMPv1 has no GETBULK, GETNEXT walks {seconds:.3f} s {requests:4d} requests")
+    elif tables:
+        reference = [client.walk(root) for root in tables]
+        for max_repetitions in MAX_REPETITIONS:
+            try:
+                seconds, requests, walked = timed(
+                    client, lambda: [client.walk(root, max_repetitions) for root in tables], rounds
+                )
+            except BrokenAgent as e:
+                report.append(f"max_repetitions {max_repetitions:3d}: broken, {e}")
+                continue
+            if walked != reference:
+                report.append(f"max_repetitions {max_repetitions:3d}: broken, walk differs from GETNEXT")
+                continue
+            report.append(f"max_repetitions {max_repetitions:3d}: {seconds:.3f} s {requests:4d} requests")
+            if best is None or seconds < best[1]:
+                best = (max_repetitions, seconds)
+
+    timeout = max(math.ceil(client.slowest * TIMEOUT_FACTOR * 2) / 2, MIN_TIMEOUT)
+    return {"max_repetitions": best[0] if best else None, "timeout": timeout, "report": report}
+
+
+def set_option(lines: list, start: int, key: str, value: str):
+    """Set key in the table whose header is lines[start], keeping a
+    trailing comment"""
+    end = start + 1
+    last = start
+    while end < len(lines) and not lines[end].strip().startswith("["):
+        if lines[end].strip():
+            last = end
+        match = re.match(rf"^(\s*{key}\s*=\s*)([^#]*?)(\s*#.*)?$", lines[end])
+        if match:
+            lines[end] = f"{match.group(1)}{value}{match.group(3) or ''}"
+            return
+        end += 1
+    lines.insert(last + 1, f"  {key} = {value}")
+
+
+def write_back(source: str, results: list) -> str:
+    lines = source.split("\n")
+    headers = [i for i, line in enumerate(lines) if line.split("#")[0].strip() == "[[inputs.snmp]]"]
+    # from the end, so inserted lines don't move the headers still to do
+    for start, result in reversed(list(zip(headers, results))):
+        if result is None:
+            continue
+        set_option(lines, start, "timeout", f'"{result["timeout"]:g}s"')
+        if result["max_repetitions"] is not None:
+            set_option(lines, start, "max_repetitions", str(result["max_repetitions"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="save a GETNEXT walk of a device")
+    record_parser.add_argument("--community", default="public")
+    record_parser.add_argument("--port", type=int, default=161)
+    record_parser.add_argument("host")
+    record_parser.add_argument("walk", help="output file")
+    tune_parser = commands.add_parser("tune", help="measure bulk settings for a template")
+    target = tune_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--walk", help="recorded walk to serve with snmp_sim.py")
+    target.add_argument("--agent", help="live agent, host[:port]")
+    tune_parser.add_argument("--community", help="instead of each input's community")
+    tune_parser.add_argument("--mibs", default=mibc.MIB_DIR, help="MIB directory")
+    tune_parser.add_argument("--rounds", type=int, default=3, help="runs of each measurement, the best counts")
+    tune_parser.add_argument("--write", action="store_true", help="write the settings into the template")
+    tune_parser.add_argument("template")
+    opts = parser.parse_args()
+
+    if opts.command == "record":
+        entries = record(Client(opts.host, opts.port, opts.community), opts.walk)
+        print(f"{len(entries)} OIDs", file=sys.stderr)
+        raise SystemExit
+
+    if opts.walk:
+        options, entries = snmp_sim.load(opts.walk)
+        # a recording answers whichever community the template uses
+        community = opts.community.encode() if opts.community else None
+        server = snmp_sim.serve(snmp_sim.Agent(entries, community, **options))
+        host, port = server.server_address
+    else:
+        host, _, port = opts.agent.partition(":")
+        port = int(port or 161)
+
+    with open(opts.template) as f:
+        source = f.read()
+    inputs = template_inputs(source, mibc.Mibs(opts.mibs))
+    results = []
+    for n, snmp_input in enumerate(inputs, 1):
+        if snmp_input["version"] not in (1, 2):
+            results.append(None)
+            print(f"{os.path.basename(opts.template)} input {n}: SNMPv{snmp_input['version']} isn't supported, skipped")
+            continue
+        version = pdu.VERSION_1 if snmp_input["version"] == 1 else pdu.VERSION_2C
+        client = Client(host, port, opts.community or snmp_input["community"], version=version)
+        result = tune(client, snmp_input, opts.rounds)
+        results.append(result)
+        print(f"{os.path.basename(opts.template)} input {n}: "
+              f"{len(snmp_input['fields'])} fields, {len(snmp_input['tables'])} table walks")
+        for line in result["report"]:
+            print(f"  {line}")
+        print(f"  max_repetitions = {result['max_repetitions']}, timeout = \"{result['timeout']:g}s\"")
+
+    if opts.write:
+        with open(f"{opts.template}.tmp", "w") as f:
+            f.write(write_back(source, results))
+        os.replace(f"{opts.template}.tmp", opts.template)